@@ -2,6 +2,7 @@ from flask import Flask
 from .extensions import db, migrate, limiter
 from .models import *
 from .api import register_blueprints
+from .utils.db import init_db_pool
 from dotenv import load_dotenv
 import os
 
@@ -11,6 +12,7 @@ def create_app():
     app.secret_key = os.environ.get("FLASK_SECRET_KEY")
     app.config.from_object('app.config.Config')
     app.config.from_prefixed_env()
+    init_db_pool(app)
     db.init_app(app)
     migrate.init_app(app, db)
     limiter.init_app(app)
@@ -1,9 +1,11 @@
 from .admin import setup_admin
 from .routes import api_bp
+from .ops import ops_bp
 
 def register_blueprints(app):
     # Register API blueprint
     app.register_blueprint(api_bp)
+    app.register_blueprint(ops_bp)
     
     # Setup Flask-Admin views
     setup_admin(app)
\ No newline at end of file
@@ -0,0 +1,68 @@
+from flask import Blueprint, Response, jsonify, request
+import time
+
+from app.api.admin import requires_auth
+from app.services import profiler
+from app.services.llm import registry
+
+ops_bp = Blueprint('ops', __name__, url_prefix='/admin/ops')
+
+
+@ops_bp.route('/providers', methods=['GET'])
+@requires_auth
+def providers_status():
+    return jsonify(registry.status())
+
+
+@ops_bp.route('/providers/reload', methods=['POST'])
+@requires_auth
+def providers_reload():
+    """
+    Rebuild provider clients in every worker from LLM_CONFIG_FILE / the environment.
+
+    Signals all workers through LLM_CONFIG_FILE and returns 202 unless ?wait=1,
+    in which case this worker's reload result is returned (409 if it failed and
+    the old config was kept). 409 if there is no config file to signal through.
+    """
+    try:
+        signalled = registry.reload_all_workers()
+    except registry.ReloadUnavailable as e:
+        return jsonify({'error': str(e), **registry.status()}), 409
+    if request.args.get('wait', '').lower() in ('1', 'true', 'yes'):
+        result = registry.wait_for_reload(signalled)
+        if result is not None:
+            ok = (result.get('last_reload') or {}).get('ok')
+            return jsonify(result), 200 if ok else 409
+    return jsonify({'status': 'reloading', **registry.status()}), 202
+
+
+@ops_bp.route('/profile', methods=['GET'])
+@requires_auth
+def profile():
+    """
+    Sample this worker for ?seconds= (default 10) at ?hz= and return collapsed
+    stacks, ready for flamegraph.pl or speedscope.
+    """
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        hz = float(request.args.get('hz', profiler.SAMPLE_HZ))
+    except ValueError:
+        return jsonify({'error': 'seconds and hz must be numbers'}), 400
+    try:
+        sampler = profiler.sample(seconds, hz)
+    except profiler.ProfilerBusy as e:
+        return jsonify({'error': str(e)}), 409
+    filename = f"fauxllama-{time.strftime('%Y%m%d-%H%M%S')}.collapsed"
+    return Response(sampler.collapsed(), mimetype='text/plain', headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Profile-Samples': str(sampler.samples),
+    })
+
+
+@ops_bp.route('/profile/hooks', methods=['GET', 'POST'])
+@requires_auth
+def profile_hooks():
+    """Show or toggle (?enabled=1|0) the hot-path timing hooks in this worker."""
+    if request.method == 'POST':
+        profiler.set_hooks(request.args.get('enabled', '1').lower() in ('1', 'true', 'yes', 'on'))
+    return jsonify(profiler.status())
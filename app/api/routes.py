@@ -1,9 +1,13 @@
-from flask import Blueprint, jsonify, request, Response, stream_with_context
+from flask import Blueprint, g, jsonify, request, Response, stream_with_context
 from app.utils.auth import authenticate_api_key
 from app.utils.api_helpers import filter_user_model_messages
-from app.services.llm.registry import auto_register_llm_from_env, active_provider
+from app.utils.request_body import body_preview, decoded_json, validate_chat_request
+from app.services.llm.registry import auto_register_llm_from_env, active_provider, get as get_provider
+from app.services.llm.router import router as model_router
 from app.services.chat_streamer import stream_events_as_sse
 from app.services.chat_logger import log_chat_message, log_conversation
+from app.services.embed_batcher import batcher as embed_batcher
+from app.services import metrics, tracing, stream_guard, single_flight, admission, capture, prompt_cache
 import uuid
 import json
 import os, sys, logging
@@ -26,10 +30,7 @@ def log_request_info():
         f"Headers: {dict(request.headers)}"
     )
     if request.method in ['POST', 'PUT', 'PATCH']:
-        try:
-            logging.info(f"Body: {request.get_data(as_text=True)}")
-        except Exception as e:
-            logging.info(f"Could not log body: {e}")
+        logging.info(f"Body: {body_preview()}")
 
 @api_bp.after_app_request
 def log_response_info(response):
@@ -47,10 +48,11 @@ def api_models_tags(api_key):
     except Exception as e:
         return jsonify({"error": str(e)}), 401
 
+    names = model_router().model_names() or [username]
     model_info = {
         "models": [{
-            "name": username,
-            "model": username,
+            "name": name,
+            "model": name,
             "modified_at": "2025-07-18T15:51:16.1962348+03:00",
             "size": 3338801804,
             "digest": "a2af6cc3eb7fa8be8504abaf9b04e88f17a119ec3f04a3addf55f92841195f5a",
@@ -62,7 +64,7 @@ def api_models_tags(api_key):
                 "parameter_size": "4.3B",
                 "quantization_level": "Q4_K_M"
             }
-        }]
+        } for name in names]
     }
     return jsonify(model_info)
 
@@ -105,13 +107,18 @@ def api_show(api_key):
     return jsonify(show_info)
 
 @api_bp.route('/<api_key>/v1/chat/completions', methods=['POST'])
+@decoded_json(validate_chat_request)
 def api_chat_completions(api_key):
+    trace = tracing.start_trace("chat.completions", request.headers.get("traceparent"))
+    trace_headers = {tracing.TRACE_HEADER: trace.trace_id}
     try:
-        apikey_id, username = authenticate_api_key(api_key)
+        with trace.span("auth"):
+            apikey_id, username = authenticate_api_key(api_key)
     except Exception as e:
-        return jsonify({"error": str(e)}), 401
+        trace.finish()
+        return jsonify({"error": str(e)}), 401, trace_headers
 
-    request_json = request.get_json(force=True)
+    request_json = g.json_body
 
     allowed_keys = {
         "temperature","top_p","n","presence_penalty","frequency_penalty",
@@ -124,56 +131,226 @@ def api_chat_completions(api_key):
     chat_messages = filter_user_model_messages(messages)
     conv_id = str(uuid.uuid4())
     model = request_json.get('model', 'unknown')
-    client = active_provider()
+    try:
+        route = model_router().resolve(request_json.get('model'), chat_messages, params)
+        client = get_provider(route.provider) if route.provider else active_provider()
+    except ValueError as e:
+        trace.finish()
+        return jsonify({"error": str(e)}), 400, trace_headers
+    # Keeps a reload from closing the client before this request's call starts
+    lease = client.lease()
+    if model_router().enabled:
+        model = route.name
+    prepared = prompt_cache.prepare(client, username, chat_messages, params, model)
+    target = route.pick(prepared.affinity)
+    trace.root.set(conv_id=conv_id, model=model, provider=client.name, apikey_id=apikey_id,
+                   route_target=target or "", route_reason=route.reason)
+
+    # Requests that share an in-flight stream don't need an upstream slot; every
+    # other request takes a ticket before anything is written, so a 429 leaves no rows
+    joined = single_flight.join(client, prepared.messages, prepared.params, model=target)
+    ticket = None
+    if joined is None:
+        try:
+            ticket = admission.enqueue(client.name, apikey_id)
+        except admission.QueueFull as e:
+            lease.release()
+            trace.finish()
+            return jsonify({"error": str(e)}), 429, {"Retry-After": "1", **trace_headers}
 
-    log_conversation([chat_messages[-1]], conv_id, username, model, apikey_id)
+    try:
+        with trace.span("log_conversation"):
+            log_conversation([chat_messages[-1]], conv_id, username, model, apikey_id)
+    except Exception:
+        if joined is not None:
+            joined.close()
+        if ticket is not None:
+            ticket.release()
+        lease.release()
+        trace.finish()
+        raise
+
+    # The model the client asked for, so replays go through routing rules again
+    recorder = capture.start(username, request_json.get('model'), messages, params, prepared.messages)
+    guard = stream_guard.StreamGuard(stream_guard.client_socket(request.environ))
+    if joined is not None:
+        guard.track(joined)
+    if ticket is not None:
+        guard.on_abort(lambda reason: ticket.release())
 
     def event_stream():
         assistant_reply_parts = []
-        try:
-            for ev in client.stream_chat(chat_messages, params=params, request_id=conv_id):
-                try:
-                    delta = ev.get("choices", [{}])[0].get("delta", {})
-                    if "content" in delta:
-                        assistant_reply_parts.append(delta["content"])
-                except Exception:
-                    pass
+        upstream = joined
+        guard.start()
+        with tracing.activate(trace), stream_guard.activate(guard):
+            try:
+                with trace.span("admission"):
+                    for comment in admission.wait_turn(ticket):
+                        yield comment
 
-                for chunk in stream_events_as_sse([ev]):
-                    yield chunk
+                with trace.span("stream") as stream_span:
+                    if recorder is not None:
+                        recorder.restart_clock()
+                    chunks = 0
+                    if upstream is None:
+                        # A shared stream keeps the slot until it ends, not until this request leaves
+                        upstream = single_flight.stream_chat(client, prepared.messages, params=prepared.params,
+                                                             request_id=conv_id, model=target,
+                                                             hold=ticket.share() if ticket is not None else None)
+                    for ev in upstream:
+                        if guard.aborted:
+                            break
+                        if ev.get("usage"):
+                            trace.root.set(**prompt_cache.usage_attrs(ev["usage"]))
+                            # Requested for accounting only; don't send it to clients that didn't ask
+                            if not prepared.forward_usage and prompt_cache.is_usage_only(ev):
+                                continue
+                        if recorder is not None:
+                            recorder.chunk(ev)
+                        try:
+                            delta = ev.get("choices", [{}])[0].get("delta", {})
+                            if "content" in delta:
+                                assistant_reply_parts.append(delta["content"])
+                        except Exception:
+                            pass
 
+                        for chunk in stream_events_as_sse([ev]):
+                            trace.mark_first_byte()
+                            chunks += 1
+                            yield chunk
+                    stream_span.set(sse_chunks=chunks)
+                if recorder is not None:
+                    recorder.finish("aborted" if guard.aborted else "ok")
 
-        except Exception as e:
-            error_msg = {"error": str(e), "detail": str(e)}
-            for chunk in stream_events_as_sse([error_msg]):
-                yield chunk
+            except GeneratorExit:
+                # The server noticed the disconnect on write before the watchdog did
+                guard.abort("client_disconnected")
+                raise
 
-        finally:
-            # yield "data: [DONE]\n\n"
-            # After streaming, log the full reply
-            try:
-                log_chat_message(
-                    conv_id=conv_id,
-                    order=len(chat_messages),
-                    role='model',
-                    text="".join(assistant_reply_parts),
-                    username=username,
-                    model=model,
-                    apikey_id=apikey_id
-                )
-            except Exception:
-                logging.exception("Failed to log chat message")
-
-    return Response(
+            except Exception as e:
+                if not guard.aborted:
+                    error_msg = {"error": str(e), "detail": str(e)}
+                    for chunk in stream_events_as_sse([error_msg]):
+                        yield chunk
+
+            finally:
+                guard.stop()
+                if upstream is not None:
+                    upstream.close()
+                if ticket is not None:
+                    ticket.release()
+                lease.release()
+                status = None
+                if recorder is not None and "status" not in recorder.record:
+                    recorder.finish("aborted" if guard.aborted else "error")
+                if guard.aborted:
+                    status = "aborted"
+                    stream_guard.wasted_tokens.inc(len(assistant_reply_parts))
+                    trace.root.set(aborted=guard.reason)
+                # yield "data: [DONE]\n\n"
+                # After streaming, log the full reply
+                try:
+                    with trace.span("log_chat_message"):
+                        log_chat_message(
+                            conv_id=conv_id,
+                            order=len(chat_messages),
+                            role='model',
+                            text="".join(assistant_reply_parts),
+                            username=username,
+                            model=model,
+                            apikey_id=apikey_id,
+                            status=status
+                        )
+                except Exception:
+                    logging.exception("Failed to log chat message")
+                trace.finish()
+
+    response = Response(
         stream_with_context(event_stream()),
         mimetype='text/event-stream',
-        headers={'Cache-Control': 'no-cache', 'Connection': 'keep-alive'}
+        headers={'Cache-Control': 'no-cache', 'Connection': 'keep-alive', **trace_headers}
     )
+    # Also free the slot / subscription / lease if the stream is closed before it ever started
+    if ticket is not None:
+        response.call_on_close(ticket.release)
+    if joined is not None:
+        response.call_on_close(joined.close)
+    response.call_on_close(lease.release)
+    return response
+
+def _embed_texts(requested_model, texts):
+    # Only embedding routes apply; chat model names must not reach chat deployments
+    route = model_router().embedding_route(requested_model)
+    if route is None:
+        client, target = active_provider(), None
+    else:
+        client = get_provider(route.provider) if route.provider else active_provider()
+        target = route.target
+    lease = client.lease()
+    try:
+        return embed_batcher().embed(client, texts, model=target)
+    finally:
+        lease.release()
+
+def _embed_inputs(value):
+    texts = [value] if isinstance(value, str) else value
+    if not isinstance(texts, list) or not texts or not all(isinstance(t, str) for t in texts):
+        raise ValueError("'input' must be a string or a non-empty list of strings")
+    return texts
+
+@api_bp.route('/<api_key>/api/embed', methods=['POST'])
+@decoded_json()
+def api_embed(api_key):
+    try:
+        authenticate_api_key(api_key)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 401
+
+    request_json = g.json_body
+    try:
+        texts = _embed_inputs(request_json.get('input'))
+        vectors = _embed_texts(request_json.get('model'), texts)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.exception("Embedding request failed")
+        return jsonify({"error": str(e)}), 502
+
+    return jsonify({"model": request_json.get('model'), "embeddings": vectors})
+
+@api_bp.route('/<api_key>/v1/embeddings', methods=['POST'])
+@decoded_json()
+def api_openai_embeddings(api_key):
+    try:
+        authenticate_api_key(api_key)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 401
+
+    request_json = g.json_body
+    try:
+        texts = _embed_inputs(request_json.get('input'))
+        vectors = _embed_texts(request_json.get('model'), texts)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.exception("Embedding request failed")
+        return jsonify({"error": str(e)}), 502
+
+    return jsonify({
+        "object": "list",
+        "data": [{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(vectors)],
+        "model": request_json.get('model'),
+        "usage": {"prompt_tokens": 0, "total_tokens": 0},
+    })
 
 @api_bp.route('/health', methods=['GET'])
 def health():
     return jsonify({"status": "ok"}), 200
 
+@api_bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @api_bp.errorhandler(404)
 def not_found(e):
     return jsonify({"error": "Not found"}), 404
\ No newline at end of file
@@ -1,8 +1,26 @@
 import os
 
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
 class Config:
     SQLALCHEMY_DATABASE_URI = (
         f"postgresql://{os.environ['PG_USER']}:{os.environ['PG_PASSWORD']}@"
         f"{os.environ['PG_HOST']}:{os.environ['PG_PORT']}/{os.environ['PG_DATABASE']}"
     )
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Connection pool (per worker process)
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", "20")),
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", "10")),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": _env_bool("DB_POOL_PRE_PING", True),
+    }
+    # Request bodies larger than this are rejected with 413 before being read
+    MAX_CONTENT_LENGTH = int(os.environ.get("MAX_REQUEST_BYTES", str(16 * 1024 * 1024)))
+    # auto | true | false - make psycopg2 yield to gevent while waiting on the DB
+    DB_GEVENT_WAIT_CALLBACK = os.environ.get("DB_GEVENT_WAIT_CALLBACK", "auto")
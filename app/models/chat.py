@@ -12,6 +12,7 @@ class Chat(db.Model):
     eapc_text = db.Column(db.Text)
     eapc_username = db.Column(db.String)
     eapc_model = db.Column(db.String)
+    eapc_status = db.Column(db.String)
     eaik_id = db.Column(db.Integer)
     usrinsert = db.Column(db.String)
     dteinsert = db.Column(db.DateTime, default=datetime.datetime.utcnow)
@@ -0,0 +1,263 @@
+"""
+Admission control in front of the upstream provider.
+
+Each provider gets a global in-flight limit (per worker) and a bounded wait
+queue. Waiting requests are dequeued with start-time fair queueing keyed by
+APIKey: every ticket is tagged `max(virtual_clock, last_tag[key]) + 1/weight`
+and the smallest tag is admitted next, so a single heavy key cannot starve the
+others once the upstream is saturated. The same holds for joining the queue:
+when it is full, a newcomer displaces the newest ticket of the key with the
+most queued requests (if that key has more than the newcomer's). Queued
+tickets expire after ADMISSION_QUEUE_TIMEOUT seconds.
+
+Env:
+  - ADMISSION_MAX_INFLIGHT       concurrent upstream streams per provider (default 64, 0 disables)
+  - ADMISSION_MAX_QUEUE          waiting requests per provider (default 256)
+  - ADMISSION_QUEUE_TIMEOUT      seconds a request may wait (default 30)
+  - ADMISSION_KEEPALIVE_INTERVAL seconds between SSE keep-alive comments (default 5, 0 disables)
+  - ADMISSION_WEIGHTS            per-key weights, e.g. "12:2,7:0.5" (APIKey id: weight, default 1)
+"""
+from __future__ import annotations
+import heapq
+import itertools
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from . import metrics
+from .chat_streamer import sse_comment
+
+MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "64"))
+MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+KEEPALIVE_INTERVAL = float(os.getenv("ADMISSION_KEEPALIVE_INTERVAL", "5"))
+
+
+def _parse_weights(spec: str) -> Dict[str, float]:
+    weights: Dict[str, float] = {}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        key, _, weight = item.partition(":")
+        weights[key.strip()] = float(weight)
+    return weights
+
+
+WEIGHTS = _parse_weights(os.getenv("ADMISSION_WEIGHTS", ""))
+
+queue_depth = metrics.gauge(
+    "fauxllama_admission_queue_depth",
+    "Requests waiting for an upstream slot.",
+    ["provider"],
+)
+inflight = metrics.gauge(
+    "fauxllama_admission_inflight",
+    "Admitted upstream streams.",
+    ["provider"],
+)
+wait_seconds = metrics.histogram(
+    "fauxllama_admission_wait_seconds",
+    "Time requests spent queued before being admitted.",
+    ["provider"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+rejected = metrics.counter(
+    "fauxllama_admission_rejected_total",
+    "Requests rejected by admission control.",
+    ["provider", "reason"],
+)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class AdmissionTimeout(Exception):
+    pass
+
+
+class Ticket:
+    WAITING, ADMITTED, RELEASED, CANCELLED = "waiting", "admitted", "released", "cancelled"
+
+    def __init__(self, scheduler: "Scheduler", key: str, tag: float, deadline: float) -> None:
+        self.scheduler = scheduler
+        self.key = key
+        self.tag = tag
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.state = Ticket.WAITING
+        self.cancel_reason = "Request cancelled while queued"
+        self.holders = 1  # the request, plus one per share()
+        self._owner_released = False
+        self._event = threading.Event()
+
+    def wait(self, timeout: float) -> bool:
+        """Wait up to `timeout`; True once admitted. Raises AdmissionTimeout past the deadline."""
+        remaining = self.deadline - time.monotonic()
+        self._event.wait(max(0.0, min(timeout, remaining)))
+        if self.state == Ticket.ADMITTED:
+            return True
+        if self.state == Ticket.CANCELLED:
+            raise AdmissionTimeout(self.cancel_reason)
+        if time.monotonic() >= self.deadline:
+            self.scheduler.cancel(self, reason="deadline")
+            if self.state == Ticket.ADMITTED:
+                return True
+            raise AdmissionTimeout(f"Upstream busy: waited {QUEUE_TIMEOUT:g}s for a slot")
+        return False
+
+    def release(self) -> None:
+        """Give the slot back (or leave the queue). Safe to call more than once."""
+        self.scheduler.release(self)
+
+    def share(self) -> Callable[[], None]:
+        """
+        A second release for this admitted slot, for work that can outlive the
+        request (a shared upstream stream that followers still read). The slot
+        is given back once release() and every shared release were called.
+        """
+        return self.scheduler.share(self)
+
+
+class Scheduler:
+    def __init__(self, provider: str, limit: int, max_queue: int) -> None:
+        self.provider = provider
+        self.limit = limit
+        self.max_queue = max_queue
+        self.inflight = 0
+        self.waiting = 0
+        self._heap: List[Tuple[float, int, Ticket]] = []
+        self._seq = itertools.count()
+        self._vclock = 0.0
+        self._last_tag: Dict[str, float] = {}
+        self._queued: Dict[str, List[Ticket]] = {}  # waiting tickets per key, oldest first
+        self._lock = threading.Lock()
+
+    def enqueue(self, key: str, weight: float = 1.0, timeout: float = QUEUE_TIMEOUT) -> Ticket:
+        with self._lock:
+            tag = max(self._vclock, self._last_tag.get(key, 0.0)) + 1.0 / max(weight, 1e-6)
+            ticket = Ticket(self, key, tag, time.monotonic() + timeout)
+            if self.inflight < self.limit and not self.waiting:
+                self._admit(ticket)
+                return ticket
+            if self.waiting >= self.max_queue and not self._displace_for(key):
+                rejected.inc(provider=self.provider, reason="queue_full")
+                raise QueueFull("Upstream busy: admission queue is full")
+            self._last_tag[key] = tag
+            heapq.heappush(self._heap, (tag, next(self._seq), ticket))
+            self._queued.setdefault(key, []).append(ticket)
+            self.waiting += 1
+            queue_depth.set(self.waiting, provider=self.provider)
+            return ticket
+
+    def _displace_for(self, key: str) -> bool:
+        """Free a queue slot for `key` by dropping the heaviest key's newest ticket."""
+        mine = len(self._queued.get(key, ()))
+        heaviest = max(self._queued, key=lambda k: len(self._queued[k]), default=None)
+        if heaviest is None or len(self._queued[heaviest]) <= mine + 1:
+            return False
+        victim = self._queued[heaviest][-1]
+        victim.cancel_reason = "Upstream busy: queue slot given to another API key"
+        self._cancel(victim)
+        rejected.inc(provider=self.provider, reason="displaced")
+        return True
+
+    def release(self, ticket: Ticket) -> None:
+        with self._lock:
+            if ticket.state == Ticket.WAITING:
+                self._cancel(ticket)
+            elif not ticket._owner_released:
+                ticket._owner_released = True
+                self._drop_holder(ticket)
+
+    def share(self, ticket: Ticket) -> Callable[[], None]:
+        with self._lock:
+            ticket.holders += 1
+        released = []
+
+        def release() -> None:
+            with self._lock:
+                if released:
+                    return
+                released.append(True)
+                self._drop_holder(ticket)
+        return release
+
+    def _drop_holder(self, ticket: Ticket) -> None:
+        ticket.holders -= 1
+        if ticket.holders <= 0 and ticket.state == Ticket.ADMITTED:
+            ticket.state = Ticket.RELEASED
+            self.inflight -= 1
+            inflight.set(self.inflight, provider=self.provider)
+            self._dispatch()
+
+    def cancel(self, ticket: Ticket, reason: str = "cancelled") -> None:
+        with self._lock:
+            if ticket.state == Ticket.WAITING:
+                self._cancel(ticket)
+                rejected.inc(provider=self.provider, reason=reason)
+
+    def _unqueue(self, ticket: Ticket) -> None:
+        tickets = self._queued.get(ticket.key)
+        if tickets is not None:
+            tickets.remove(ticket)
+            if not tickets:
+                del self._queued[ticket.key]
+
+    def _cancel(self, ticket: Ticket) -> None:
+        # Removed lazily from the heap by _dispatch
+        ticket.state = Ticket.CANCELLED
+        self._unqueue(ticket)
+        self.waiting -= 1
+        queue_depth.set(self.waiting, provider=self.provider)
+        ticket._event.set()
+
+    def _admit(self, ticket: Ticket) -> None:
+        ticket.state = Ticket.ADMITTED
+        self.inflight += 1
+        inflight.set(self.inflight, provider=self.provider)
+        wait_seconds.observe(time.monotonic() - ticket.enqueued_at, provider=self.provider)
+        ticket._event.set()
+
+    def _dispatch(self) -> None:
+        while self.inflight < self.limit and self._heap:
+            tag, _, ticket = heapq.heappop(self._heap)
+            if ticket.state != Ticket.WAITING:
+                continue
+            self._unqueue(ticket)
+            self.waiting -= 1
+            queue_depth.set(self.waiting, provider=self.provider)
+            self._vclock = tag
+            if self._last_tag.get(ticket.key, 0.0) <= tag:
+                self._last_tag.pop(ticket.key, None)
+            self._admit(ticket)
+
+
+_SCHEDULERS: Dict[str, Scheduler] = {}
+_SCHEDULERS_LOCK = threading.Lock()
+
+
+def _scheduler(provider: str) -> Scheduler:
+    with _SCHEDULERS_LOCK:
+        s = _SCHEDULERS.get(provider)
+        if s is None:
+            s = _SCHEDULERS[provider] = Scheduler(provider, MAX_INFLIGHT, MAX_QUEUE)
+        return s
+
+
+def enqueue(provider: str, apikey_id: object) -> Optional[Ticket]:
+    """Reserve a place for `apikey_id`; None when admission control is disabled."""
+    if MAX_INFLIGHT <= 0:
+        return None
+    key = str(apikey_id)
+    return _scheduler(provider).enqueue(key, WEIGHTS.get(key, 1.0))
+
+
+def wait_turn(ticket: Optional[Ticket]) -> Iterator[str]:
+    """Yield SSE keep-alive comments until `ticket` is admitted."""
+    if ticket is None:
+        return
+    # Without keep-alives, wait for admission or the deadline in one go
+    interval = KEEPALIVE_INTERVAL if KEEPALIVE_INTERVAL > 0 else float("inf")
+    while not ticket.wait(interval):
+        if KEEPALIVE_INTERVAL > 0:
+            yield sse_comment("queued")
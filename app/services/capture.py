@@ -0,0 +1,138 @@
+"""
+Opt-in traffic capture for offline replay (see tools/replay.py).
+
+With CAPTURE_FILE set, a sample (CAPTURE_SAMPLE_RATE) of chat requests is
+appended to that JSONL file together with the upstream chunk timing:
+
+    {"ts": 1729500000.123, "user": "<sha256 prefix>", "model": "...",
+     "params": {...}, "messages": [...], "match_key": "...",
+     "upstream": {"ttft_ms": 812.4, "chunks": [[812.4, 5], [845.0, 3], ...]},
+     "status": "ok"}
+
+Records are sanitized: no API keys or headers are written, usernames are
+hashed, and with CAPTURE_REDACT_CONTENT (default on) every word of message
+content and of free-text request params (tool descriptions, stop sequences) is
+replaced by filler of the same length so prompt sizes and shapes survive but
+the text does not.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .llm.base import ChatMessage, ModelParams, StreamEvent
+
+log = logging.getLogger(__name__)
+
+CAPTURE_FILE = os.getenv("CAPTURE_FILE")
+SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", "1"))
+REDACT_CONTENT = (os.getenv("CAPTURE_REDACT_CONTENT") or "true").strip().lower() in ("1", "true", "yes", "on")
+
+_FILLER = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor".replace(" ", "")
+_WORD = re.compile(r"\w+")
+_lock = threading.Lock()
+
+
+def _redact_text(text: str) -> str:
+    return _WORD.sub(lambda m: (_FILLER * (len(m.group()) // len(_FILLER) + 1))[:len(m.group())], text)
+
+
+def _redact(value: Any) -> Any:
+    if isinstance(value, str):
+        return _redact_text(value)
+    if isinstance(value, list):
+        return [_redact(v) for v in value]
+    if isinstance(value, dict):
+        return {k: (v if k in ("role", "type", "name", "tool_call_id") else _redact(v)) for k, v in value.items()}
+    return value
+
+
+def sanitize_messages(messages: List[ChatMessage]) -> List[ChatMessage]:
+    return _redact(messages) if REDACT_CONTENT else messages
+
+
+# Params that are free text outright, and keys holding free text anywhere inside
+# the others (tool and JSON-schema descriptions). Everything else (tool_choice,
+# modalities, schema `required`/`enum`, names) is kept so replayed requests stay valid.
+_TEXT_PARAMS = ("stop",)
+_TEXT_KEYS = ("description",)
+
+
+def _redact_descriptions(value: Any) -> Any:
+    if isinstance(value, list):
+        return [_redact_descriptions(v) for v in value]
+    if isinstance(value, dict):
+        return {k: (_redact_text(v) if k in _TEXT_KEYS and isinstance(v, str) else _redact_descriptions(v))
+                for k, v in value.items()}
+    return value
+
+
+def sanitize_params(params: Optional[ModelParams]) -> ModelParams:
+    params = params or {}
+    if not REDACT_CONTENT:
+        return params
+    return {k: (_redact(v) if k in _TEXT_PARAMS else _redact_descriptions(v)) for k, v in params.items()}
+
+
+def match_key(messages: List[ChatMessage]) -> str:
+    """Key the fake upstream uses to find a request's recorded timing."""
+    content = messages[-1].get("content") if messages else ""
+    if not isinstance(content, str):
+        content = json.dumps(content, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+class Recorder:
+    def __init__(self, username: str, model: Optional[str], messages: List[ChatMessage],
+                 params: Optional[ModelParams], upstream_messages: List[ChatMessage]) -> None:
+        self.ts = time.time()
+        self._t0 = time.perf_counter()
+        self.record: Dict[str, Any] = {
+            "ts": round(self.ts, 3),
+            "user": hashlib.sha256(username.encode("utf-8")).hexdigest()[:12],
+            "model": model,
+            "params": sanitize_params(params),
+            "messages": sanitize_messages(messages),
+        }
+        self.record["match_key"] = match_key(sanitize_messages(upstream_messages))
+        self.chunks: List[List[float]] = []
+
+    def restart_clock(self) -> None:
+        """Measure chunk offsets from the moment the upstream call starts."""
+        self._t0 = time.perf_counter()
+
+    def chunk(self, ev: StreamEvent) -> None:
+        size = 0
+        for choice in ev.get("choices") or []:
+            size += len((choice.get("delta") or {}).get("content") or "")
+        self.chunks.append([round((time.perf_counter() - self._t0) * 1000, 1), size])
+
+    def finish(self, status: str) -> None:
+        first = next((c[0] for c in self.chunks if c[1]), None)
+        self.record["upstream"] = {"ttft_ms": first, "chunks": self.chunks}
+        self.record["status"] = status
+        line = json.dumps(self.record, ensure_ascii=False)
+        try:
+            with _lock, open(CAPTURE_FILE, "a", encoding="utf-8") as f:  # type: ignore[arg-type]
+                f.write(line + "\n")
+        except OSError:
+            log.exception("Failed to write traffic capture")
+
+
+def start(username: str, model: Optional[str], messages: List[ChatMessage], params: Optional[ModelParams],
+          upstream_messages: List[ChatMessage]) -> Optional[Recorder]:
+    """
+    A Recorder for this request, or None when capture is off or not sampled.
+
+    `messages` is what the client sent (replayed as-is); `upstream_messages` is
+    what reaches the provider and determines the match key.
+    """
+    if not CAPTURE_FILE or random.random() >= SAMPLE_RATE:
+        return None
+    return Recorder(username, model, messages, params, upstream_messages)
@@ -1,11 +1,13 @@
 from ..models import Chat
 from ..extensions import db
+from . import profiler
 import datetime
 
 def get_curr_timestamp():
     return datetime.datetime.now()
 
-def log_chat_message(conv_id, order, role, text, username, model, apikey_id):
+@profiler.timed("log_chat_message")
+def log_chat_message(conv_id, order, role, text, username, model, apikey_id, status=None):
     chat = Chat(
         eapc_conv_uuid=conv_id,
         eapc_order=order,
@@ -13,6 +15,7 @@ def log_chat_message(conv_id, order, role, text, username, model, apikey_id):
         eapc_text=text,
         eapc_username=username,
         eapc_model=model,
+        eapc_status=status,
         eaik_id=apikey_id,
         usrinsert=username,
         dteinsert=get_curr_timestamp(),
@@ -22,6 +25,7 @@ def log_chat_message(conv_id, order, role, text, username, model, apikey_id):
     db.session.commit()
     return chat.eapc_id
 
+@profiler.timed("log_chat_messages_batch")
 def log_chat_messages_batch(messages, conv_id, username, model, apikey_id):
     objs = [
         Chat(
@@ -40,5 +44,6 @@ def log_chat_messages_batch(messages, conv_id, username, model, apikey_id):
     db.session.bulk_save_objects(objs)
     db.session.commit()
 
+@profiler.timed("log_conversation")
 def log_conversation(messages, conv_id, username, model, apikey_id):
     log_chat_messages_batch(messages, conv_id, username, model, apikey_id)
\ No newline at end of file
@@ -1,6 +1,13 @@
 import json
 from typing import Iterable, Iterator, Dict, Any
 
+from . import profiler
+
+@profiler.timed("stream_events_as_sse")
 def stream_events_as_sse(events: Iterable[Dict[str, Any]]) -> Iterator[str]:
     for ev in events:
-        yield f"data: {json.dumps(ev, ensure_ascii=False)}\n\n"
\ No newline at end of file
+        yield f"data: {json.dumps(ev, ensure_ascii=False)}\n\n"
+
+def sse_comment(text: str = "") -> str:
+    """An SSE comment line; clients ignore it, but it keeps the connection alive."""
+    return f": {text}\n\n"
\ No newline at end of file
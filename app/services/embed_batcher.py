@@ -0,0 +1,243 @@
+"""
+Micro-batching and caching for embedding requests.
+
+Indexing tools send many small embedding calls. Requests for the same
+(provider, model) that arrive within EMBED_BATCH_WINDOW_MS are merged into a
+single upstream `embed()` call of at most EMBED_BATCH_MAX inputs, and the
+vectors are scattered back to each caller. Identical inputs within a batch
+are sent once. If the upstream rejects a merged batch as a client error,
+each caller's inputs are retried on their own so one bad input only fails
+the request that sent it.
+
+Vectors are optionally cached by content hash (EMBED_CACHE=lru|redis|off) and
+stored compactly as float32 bytes.
+"""
+from __future__ import annotations
+import hashlib
+import logging
+import os
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from cachetools import LRUCache
+
+from . import metrics
+from .llm.base import LLMClient
+
+log = logging.getLogger(__name__)
+
+BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "10"))
+BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "256"))
+CACHE_MODE = (os.getenv("EMBED_CACHE") or "lru").strip().lower()  # off | lru | redis
+CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "10000"))
+CACHE_TTL = int(os.getenv("EMBED_CACHE_TTL", "604800"))
+REDIS_URL = os.getenv("EMBED_CACHE_REDIS_URL") or os.getenv("RATELIMIT_STORAGE_URL")
+
+Vector = List[float]
+
+batch_size = metrics.histogram(
+    "fauxllama_embed_batch_size",
+    "Inputs per upstream embedding call.",
+    ["provider"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+cache_lookups = metrics.counter(
+    "fauxllama_embed_cache_lookups_total",
+    "Embedding cache lookups by result.",
+    ["result"],
+)
+
+
+def _pack(vector: Vector) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob: bytes) -> Vector:
+    a = array("f")
+    a.frombytes(blob)
+    return a.tolist()
+
+
+class VectorCache:
+    def __init__(self, mode: str) -> None:
+        self.mode = mode
+        self._lru: Optional[LRUCache] = LRUCache(maxsize=CACHE_SIZE) if mode == "lru" else None
+        self._redis = None
+        if mode == "redis" and REDIS_URL:
+            import redis
+            self._redis = redis.Redis.from_url(REDIS_URL)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(provider: str, model: Optional[str], text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"fauxllama:emb:{provider}:{model or ''}:{digest}"
+
+    def get_many(self, keys: List[str]) -> List[Optional[Vector]]:
+        if self._lru is not None:
+            with self._lock:
+                blobs = [self._lru.get(k) for k in keys]
+        elif self._redis is not None:
+            try:
+                blobs = self._redis.mget(keys)
+            except Exception:
+                log.warning("Embedding cache read failed", exc_info=True)
+                blobs = [None] * len(keys)
+        else:
+            return [None] * len(keys)
+        out = [_unpack(b) if b is not None else None for b in blobs]
+        hits = sum(1 for v in out if v is not None)
+        cache_lookups.inc(hits, result="hit")
+        cache_lookups.inc(len(keys) - hits, result="miss")
+        return out
+
+    def put_many(self, items: List[Tuple[str, Vector]]) -> None:
+        if self._lru is not None:
+            with self._lock:
+                for k, v in items:
+                    self._lru[k] = _pack(v)
+        elif self._redis is not None and items:
+            try:
+                pipe = self._redis.pipeline(transaction=False)
+                for k, v in items:
+                    pipe.set(k, _pack(v), ex=CACHE_TTL)
+                pipe.execute()
+            except Exception:
+                log.warning("Embedding cache write failed", exc_info=True)
+
+
+def _is_client_error(e: BaseException) -> bool:
+    """4xx from the upstream, other than auth and rate limiting (which would fail every caller)."""
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in (401, 403, 429)
+
+
+class _Batch:
+    def __init__(self) -> None:
+        self.texts: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.callers: List[List[int]] = []
+        self.results: Optional[List[Vector]] = None
+        self.error: Optional[BaseException] = None
+        # Set instead of results/error when the batch was retried caller by caller
+        self.caller_results: Dict[int, List[Vector]] = {}
+        self.caller_errors: Dict[int, BaseException] = {}
+        self.done = threading.Event()
+        self.flushing = False
+
+    def add(self, texts: List[str]) -> int:
+        """Add one caller's texts; returns the caller's id for result()."""
+        slots = []
+        for t in texts:
+            if t not in self.index:
+                self.index[t] = len(self.texts)
+                self.texts.append(t)
+            slots.append(self.index[t])
+        self.callers.append(slots)
+        return len(self.callers) - 1
+
+    def result(self, caller: int) -> List[Vector]:
+        if caller in self.caller_errors:
+            raise self.caller_errors[caller]
+        if caller in self.caller_results:
+            return self.caller_results[caller]
+        if self.error is not None:
+            raise self.error
+        return [self.results[s] for s in self.callers[caller]]  # type: ignore[index]
+
+
+class EmbedBatcher:
+    def __init__(self, window_ms: float = BATCH_WINDOW_MS, max_batch: int = BATCH_MAX,
+                 cache: Optional[VectorCache] = None) -> None:
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.cache = cache
+        self._open: Dict[Tuple[str, Optional[str]], _Batch] = {}
+        self._lock = threading.Lock()
+
+    def embed(self, client: LLMClient, texts: List[str], model: Optional[str] = None) -> List[Vector]:
+        keys: List[str] = []
+        results: List[Optional[Vector]] = [None] * len(texts)
+        if self.cache is not None:
+            # Key on the model actually used, so a changed default never serves stale vectors
+            resolved = client.embedding_model_for(model)
+            keys = [VectorCache.key(client.name, resolved, t) for t in texts]
+            results = self.cache.get_many(keys)
+
+        missing = [i for i, v in enumerate(results) if v is None]
+        if missing:
+            vectors = self._submit(client, [texts[i] for i in missing], model)
+            for i, v in zip(missing, vectors):
+                results[i] = v
+            if self.cache is not None:
+                self.cache.put_many([(keys[i], results[i]) for i in missing])
+        return results  # type: ignore[return-value]
+
+    def _submit(self, client: LLMClient, texts: List[str], model: Optional[str]) -> List[Vector]:
+        """Add `texts` to the open batch for (client, model) and wait for its flush."""
+        out: List[Vector] = []
+        # Requests larger than one batch are split across several
+        for start in range(0, len(texts), self.max_batch):
+            chunk = texts[start:start + self.max_batch]
+            with self._lock:
+                key = (client.name, model)
+                batch = self._open.get(key)
+                if batch is None or len(batch.texts) + len(chunk) > self.max_batch:
+                    batch = self._open[key] = _Batch()
+                    threading.Thread(target=self._flush_later, args=(client, model, batch),
+                                     daemon=True).start()
+                caller = batch.add(chunk)
+                if len(batch.texts) >= self.max_batch:
+                    self._close(key, batch)
+                    threading.Thread(target=self._flush, args=(client, model, batch), daemon=True).start()
+            batch.done.wait()
+            out.extend(batch.result(caller))
+        return out
+
+    def _close(self, key: Tuple[str, Optional[str]], batch: _Batch) -> None:
+        if self._open.get(key) is batch:
+            del self._open[key]
+
+    def _flush_later(self, client: LLMClient, model: Optional[str], batch: _Batch) -> None:
+        time.sleep(self.window)
+        with self._lock:
+            self._close((client.name, model), batch)
+        self._flush(client, model, batch)
+
+    def _flush(self, client: LLMClient, model: Optional[str], batch: _Batch) -> None:
+        with self._lock:
+            if batch.flushing:
+                return
+            batch.flushing = True
+        try:
+            batch_size.observe(len(batch.texts), provider=client.name)
+            batch.results = client.embed(batch.texts, model=model)
+        except BaseException as e:
+            if len(batch.callers) > 1 and _is_client_error(e):
+                self._embed_each(client, model, batch)
+            else:
+                batch.error = e
+        finally:
+            batch.done.set()
+
+    def _embed_each(self, client: LLMClient, model: Optional[str], batch: _Batch) -> None:
+        """Retry every caller of a rejected batch separately so only the bad input fails."""
+        for caller, slots in enumerate(batch.callers):
+            texts = [batch.texts[s] for s in slots]
+            try:
+                batch_size.observe(len(texts), provider=client.name)
+                batch.caller_results[caller] = client.embed(texts, model=model)
+            except BaseException as e:
+                batch.caller_errors[caller] = e
+
+
+_BATCHER: Optional[EmbedBatcher] = None
+
+
+def batcher() -> EmbedBatcher:
+    global _BATCHER
+    if _BATCHER is None:
+        _BATCHER = EmbedBatcher(cache=VectorCache(CACHE_MODE) if CACHE_MODE != "off" else None)
+    return _BATCHER
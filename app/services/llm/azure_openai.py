@@ -1,35 +1,94 @@
 from __future__ import annotations
 import os, json
 import requests
-from typing import Iterator, List, Optional, Dict, Any
-from requests.adapters import HTTPAdapter, Retry
-from .base import LLMClient, StreamEvent, ChatMessage, ModelParams
+from typing import Iterator, List, Mapping, Optional, Dict, Any
+from requests.adapters import Retry
+from .base import LLMClient, StreamEvent, ChatMessage, ModelParams, Embedding
+from .transport import build_session, ConnectionWarmer
+from .. import tracing, stream_guard, profiler, prompt_cache
+
+# First api-version that accepts stream_options; older ones answer 400
+STREAM_OPTIONS_SINCE = "2024-09-01"
+
+def _flag(value: Optional[str], default: bool) -> bool:
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
 
 class AzureOpenAIClient(LLMClient):
     name = "azure"
 
-    def __init__(self) -> None:
-        self.endpoint = os.environ["AZURE_OPENAI_ENDPOINT"].rstrip("/")
-        self.deployment = os.environ["AZURE_OPENAI_DEPLOYMENT"]
-        self.key = os.environ["AZURE_OPENAI_KEY"]
-        self.version = os.environ.get("AZURE_OPENAI_VERSION", "2024-12-01-preview")
+    def __init__(self, env: Optional[Mapping[str, str]] = None) -> None:
+        env = os.environ if env is None else env
+        self.endpoint = env["AZURE_OPENAI_ENDPOINT"].rstrip("/")
+        self.deployment = env["AZURE_OPENAI_DEPLOYMENT"]
+        self.key = env["AZURE_OPENAI_KEY"]
+        self.version = env.get("AZURE_OPENAI_VERSION", "2024-12-01-preview")
+        self.embedding_deployment = env.get("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+        # Only newer api-versions accept prompt_cache_key; older ones reject unknown params
+        self.supports_prompt_cache_key = (
+            (env.get("AZURE_OPENAI_PROMPT_CACHE_KEY") or "false").strip().lower() in ("1", "true", "yes", "on")
+        )
+        # Same for stream_options.include_usage; defaults from the api-version
+        self.supports_stream_usage = _flag(
+            env.get("AZURE_OPENAI_STREAM_USAGE"), self.version[:10] >= STREAM_OPTIONS_SINCE
+        )
 
-        self._session = requests.Session()
         retries = Retry(
             total=3,
             backoff_factor=0.5,
             status_forcelist=(429, 500, 502, 503, 504),
             allowed_methods=frozenset(["POST"]),
         )
-        self._session.mount("https://", HTTPAdapter(max_retries=retries))
+        self._session = build_session(self.name, "AZURE_OPENAI", retries, env)
+        self._warmer = ConnectionWarmer.from_env(self.name, "AZURE_OPENAI", self._warm_request, env)
+
+    def _warm_request(self) -> Any:
+        return self._session.get(
+            f"{self.endpoint}/openai/models",
+            headers={"api-key": self.key},
+            params={"api-version": self.version},
+            timeout=(5, 15),
+        )
 
+    def warm(self) -> None:
+        self._warmer.start()
+
+    def close(self) -> None:
+        self._warmer.stop()
+        self._session.close()
+
+    def embedding_model_for(self, model: Optional[str] = None) -> Optional[str]:
+        return model or self.embedding_deployment
+
+    def embed(self, texts: List[str], model: Optional[str] = None) -> List[Embedding]:
+        deployment = self.embedding_model_for(model)
+        if not deployment:
+            raise RuntimeError("AZURE_OPENAI_EMBEDDING_DEPLOYMENT is required for embeddings")
+        url = f"{self.endpoint}/openai/deployments/{deployment}/embeddings"
+        self._warmer.touch()
+        with self.in_flight():
+            resp = self._session.post(
+                url,
+                headers={"api-key": self.key, "Content-Type": "application/json"},
+                params={"api-version": self.version},
+                json={"input": texts},
+                timeout=(5, 60),
+            )
+        resp.raise_for_status()
+        data = sorted(resp.json()["data"], key=lambda d: d["index"])
+        return [d["embedding"] for d in data]
+
+    @profiler.timed("stream_chat")
     def stream_chat(
         self,
         messages: List[ChatMessage],
         params: Optional[ModelParams] = None,
         request_id: Optional[str] = None,
+        model: Optional[str] = None,
     ) -> Iterator[StreamEvent]:
-        url = f"{self.endpoint}/openai/deployments/{self.deployment}/chat/completions"
+        deployment = model or self.deployment
+        url = f"{self.endpoint}/openai/deployments/{deployment}/chat/completions"
         query = {"api-version": self.version}
         headers = {
             "api-key": self.key,
@@ -43,9 +102,19 @@ class AzureOpenAIClient(LLMClient):
         defaults: Dict[str, Any] = {"temperature": 0.1, "top_p": 1, "n": 1}
         payload.update({**defaults, **(params or {})})
 
-        with self._session.post(url, headers=headers, params=query, json=payload, stream=True, timeout=(5, 300)) as resp:
+        self._warmer.touch()
+        with self.in_flight():
+            with tracing.span("upstream.connect", provider=self.name, deployment=deployment):
+                resp = self._session.post(url, headers=headers, params=query, json=payload, stream=True, timeout=(5, 300))
+            stream_guard.track(resp)
+            yield from self._read_stream(resp, deployment)
+
+    def _read_stream(self, resp: Any, model: str) -> Iterator[StreamEvent]:
+        with resp:
             resp.raise_for_status()
+            first_chunk = tracing.start_span("upstream.first_chunk", provider=self.name)
             for raw in resp.iter_lines():
+                first_chunk.end()
                 if not raw:
                     continue
                 line = raw.decode("utf-8")
@@ -60,11 +129,15 @@ class AzureOpenAIClient(LLMClient):
 
                 try:
                     parsed = json.loads(data_json)
-                    yield {
+                    ev: StreamEvent = {
                         "id": parsed.get("id"),
                         "model": parsed.get("model"),
                         "choices": parsed.get("choices", []),
                         "raw": data_json,
                     }
+                    if parsed.get("usage"):
+                        ev["usage"] = parsed["usage"]
+                        prompt_cache.observe_usage(self.name, model, parsed["usage"])
+                    yield ev
                 except Exception as e:
                     yield {"error": f"Bad chunk: {e}", "raw": data_json}
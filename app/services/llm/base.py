@@ -1,9 +1,12 @@
 from __future__ import annotations
+import threading
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from typing import Dict, Iterable, Iterator, List, Optional, Any, Protocol, TypedDict
 
 ChatMessage = Dict[str, Any]
 ModelParams = Dict[str, Any]
+Embedding = List[float]
 
 class StreamEvent(TypedDict, total=False):
     ''' Normalized streaming event your API can pipe through as SSE "data: ..." '''
@@ -17,6 +20,39 @@ class StreamEvent(TypedDict, total=False):
 class LLMClient(ABC):
     """Provider-agnostic streaming chat client."""
     name: str
+    # Accepts `prompt_cache_key` and `stream_options.include_usage` (see services/prompt_cache.py)
+    supports_prompt_cache_key: bool = False
+    supports_stream_usage: bool = False
+    _inflight: int = 0
+    _inflight_lock = threading.Lock()
+
+    @contextmanager
+    def in_flight(self) -> Iterator[None]:
+        """Count an upstream call so a retired client is only closed once drained."""
+        lease = self.lease()
+        try:
+            yield
+        finally:
+            lease.release()
+
+    def lease(self) -> "Lease":
+        """
+        Count this client as in use until the lease is released.
+
+        Requests take one as soon as they pick a client, so a reload doesn't
+        close it while they are still queued or logging before the call starts.
+        """
+        with self._inflight_lock:
+            self._inflight += 1
+        return Lease(self)
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def _unlease(self) -> None:
+        with self._inflight_lock:
+            self._inflight -= 1
 
     @abstractmethod
     def stream_chat(
@@ -24,10 +60,46 @@ class LLMClient(ABC):
         messages: List[ChatMessage],
         params: Optional[ModelParams] = None,
         request_id: Optional[str] = None,
+        model: Optional[str] = None,
     ) -> Iterator[StreamEvent]:
-        """Yield normalized StreamEvent objects until complete."""
+        """Yield normalized StreamEvent objects until complete.
+
+        `model` overrides the provider's configured deployment/model for this call.
+        """
         raise NotImplementedError
 
+    def embed(self, texts: List[str], model: Optional[str] = None) -> List[Embedding]:
+        """Return one embedding per input text, in order."""
+        raise NotImplementedError(f"Provider '{self.name}' does not support embeddings")
+
+    def embedding_model_for(self, model: Optional[str] = None) -> Optional[str]:
+        """The model/deployment embed(model=model) actually uses."""
+        return model
+
     def validate(self) -> None:
         """Validate credentials/connectivity. Raise RuntimeError if invalid."""
-        return
\ No newline at end of file
+        return
+
+    def warm(self) -> None:
+        """Open keep-alive connections to the upstream ahead of traffic."""
+        return
+
+    def close(self) -> None:
+        """Stop background work and release pooled connections."""
+        return
+
+
+class Lease:
+    """An LLMClient.lease(); release() is idempotent so every exit path can call it."""
+
+    def __init__(self, client: LLMClient) -> None:
+        self._client = client
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self) -> None:
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._client._unlease()
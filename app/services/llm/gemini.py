@@ -3,6 +3,7 @@ from typing import Iterator, List, Optional
 
 class GeminiClient(LLMClient):
     name = "gemini"
-    def stream_chat(self, messages: List[ChatMessage], model: Optional[str] = None,
-                    params: Optional[ModelParams] = None, request_id: Optional[str] = None) -> Iterator[StreamEvent]:
+    def stream_chat(self, messages: List[ChatMessage],
+                    params: Optional[ModelParams] = None, request_id: Optional[str] = None,
+                    model: Optional[str] = None) -> Iterator[StreamEvent]:
         raise NotImplementedError
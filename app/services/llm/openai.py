@@ -2,12 +2,14 @@
 from __future__ import annotations
 import os
 import json
-from typing import Iterator, List, Optional, Dict, Any
+from typing import Iterator, List, Mapping, Optional, Dict, Any
 
 import requests
-from requests.adapters import HTTPAdapter, Retry
+from requests.adapters import Retry
 
-from .base import LLMClient, StreamEvent, ChatMessage, ModelParams
+from .base import LLMClient, StreamEvent, ChatMessage, ModelParams, Embedding
+from .transport import build_session, ConnectionWarmer
+from .. import tracing, stream_guard, profiler, prompt_cache
 
 
 class OpenAIClient(LLMClient):
@@ -21,31 +23,39 @@ class OpenAIClient(LLMClient):
     Optional env:
       - OPENAI_BASE           (default: https://api.openai.com/v1)
       - OPENAI_MODEL          (fallback model if none is provided at call time)
+      - OPENAI_EMBEDDING_MODEL (default: text-embedding-3-small)
       - OPENAI_ORG            (sets OpenAI-Organization header)
       - OPENAI_PROJECT        (sets OpenAI-Project header, if your tenant uses it)
     """
     name = "openai"
+    supports_prompt_cache_key = True
+    supports_stream_usage = True
 
-    def __init__(self) -> None:
-        key = os.environ.get("OPENAI_API_KEY")
+    def __init__(self, env: Optional[Mapping[str, str]] = None) -> None:
+        env = os.environ if env is None else env
+        key = env.get("OPENAI_API_KEY")
         if not key:
             raise RuntimeError("OPENAI_API_KEY is required for OpenAIClient")
 
-        self.base = (os.environ.get("OPENAI_BASE") or "https://api.openai.com/v1").rstrip("/")
+        self.base = (env.get("OPENAI_BASE") or "https://api.openai.com/v1").rstrip("/")
         self.key = key
-        self.default_model = os.environ.get("OPENAI_MODEL")  # e.g., "gpt-4o-mini"
-        self.org = os.environ.get("OPENAI_ORG")
-        self.project = os.environ.get("OPENAI_PROJECT")
+        self.default_model = env.get("OPENAI_MODEL")  # e.g., "gpt-4o-mini"
+        self.embedding_model = env.get("OPENAI_EMBEDDING_MODEL") or "text-embedding-3-small"
+        self.org = env.get("OPENAI_ORG")
+        self.project = env.get("OPENAI_PROJECT")
 
-        self._session = requests.Session()
         retries = Retry(
             total=3,
             backoff_factor=0.5,
             status_forcelist=(429, 500, 502, 503, 504),
             allowed_methods=frozenset(["POST"]),
         )
-        self._session.mount("https://", HTTPAdapter(max_retries=retries))
-        self._session.mount("http://", HTTPAdapter(max_retries=retries))
+        self._session = build_session(self.name, "OPENAI", retries, env)
+        self._warmer = ConnectionWarmer.from_env(
+            self.name, "OPENAI",
+            lambda: self._session.get(f"{self.base}/models", headers=self._headers(), timeout=(5, 15)),
+            env,
+        )
 
     def _headers(self) -> Dict[str, str]:
         headers = {
@@ -68,12 +78,35 @@ class OpenAIClient(LLMClient):
         if resp.status_code == 200:
             return
         if resp.status_code in (401, 403):
-            key = os.environ.get("OPENAI_API_KEY")
+            key = self.key
             raise RuntimeError(f"Invalid OpenAI API key {key} or access denied (HTTP {resp.status_code}).")
         if resp.status_code == 429:
             return
         raise RuntimeError(f"OpenAI validation failed (HTTP {resp.status_code}): {resp.text[:500]}")
 
+    def warm(self) -> None:
+        self._warmer.start()
+
+    def close(self) -> None:
+        self._warmer.stop()
+        self._session.close()
+
+    def embedding_model_for(self, model: Optional[str] = None) -> Optional[str]:
+        return model or self.embedding_model
+
+    def embed(self, texts: List[str], model: Optional[str] = None) -> List[Embedding]:
+        self._warmer.touch()
+        with self.in_flight():
+            resp = self._session.post(
+                f"{self.base}/embeddings",
+                headers=self._headers(),
+                json={"model": self.embedding_model_for(model), "input": texts},
+                timeout=(5, 60),
+            )
+        resp.raise_for_status()
+        data = sorted(resp.json()["data"], key=lambda d: d["index"])
+        return [d["embedding"] for d in data]
+
     def _filter_params(self, params: Optional[ModelParams]) -> Dict[str, Any]:
         """
         Only pass through parameters that OpenAI's chat/completions understands.
@@ -96,17 +129,20 @@ class OpenAIClient(LLMClient):
             "tool_choice",
             "response_format",
             "stream_options",
+            "prompt_cache_key",
             "modalities",
             "audio",
             "vision",
         }
         return {k: v for k, v in params.items() if k in allowed and v is not None}
 
+    @profiler.timed("stream_chat")
     def stream_chat(
         self,
         messages: List[ChatMessage],
         params: Optional[ModelParams] = None,
         request_id: Optional[str] = None,
+        model: Optional[str] = None,
     ) -> Iterator[StreamEvent]:
         """
         Yields dict events shaped like:
@@ -119,7 +155,7 @@ class OpenAIClient(LLMClient):
 
         Terminates cleanly when the provider sends [DONE].
         """
-        resolved_model = self.default_model
+        resolved_model = model or self.default_model
         if not resolved_model:
             resolved_model = "gpt-4o-mini"
 
@@ -134,16 +170,26 @@ class OpenAIClient(LLMClient):
 
         timeout = (5, 300)
 
-        with self._session.post(
-            url,
-            headers=self._headers(),
-            json=payload,
-            stream=True,
-            timeout=timeout,
-        ) as resp:
+        self._warmer.touch()
+        with self.in_flight():
+            with tracing.span("upstream.connect", provider=self.name, model=resolved_model):
+                resp = self._session.post(
+                    url,
+                    headers=self._headers(),
+                    json=payload,
+                    stream=True,
+                    timeout=timeout,
+                )
+            stream_guard.track(resp)
+            yield from self._read_stream(resp, resolved_model)
+
+    def _read_stream(self, resp: Any, model: str) -> Iterator[StreamEvent]:
+        with resp:
             resp.raise_for_status()
 
+            first_chunk = tracing.start_span("upstream.first_chunk", provider=self.name)
             for raw in resp.iter_lines():
+                first_chunk.end()
                 if not raw:
                     continue
                 line = raw.decode("utf-8")
@@ -159,11 +205,15 @@ class OpenAIClient(LLMClient):
 
                 try:
                     parsed = json.loads(data_json)
-                    yield {
+                    ev: StreamEvent = {
                         "id": parsed.get("id"),
                         "model": parsed.get("model"),
                         "choices": parsed.get("choices", []),
                         "raw": data_json,
                     }
+                    if parsed.get("usage"):
+                        ev["usage"] = parsed["usage"]
+                        prompt_cache.observe_usage(self.name, model, parsed["usage"])
+                    yield ev
                 except Exception as e:
                     yield {"error": f"Bad chunk: {e}", "raw": data_json}
@@ -1,82 +1,279 @@
+"""
+Provider registry.
+
+Clients are built from a config mapping: the process environment overlaid
+with LLM_CONFIG_FILE (dotenv format, same keys as .env) when that is set.
+reload() builds, validates and warms a fresh set of clients off the request
+path and swaps them in with a single assignment. Requests that already hold
+a client keep streaming on it; retired clients are closed once their
+in-flight calls drain, or after LLM_RELOAD_DRAIN_TIMEOUT seconds.
+
+Reloads are triggered by a change to LLM_CONFIG_FILE's mtime, polled every
+LLM_CONFIG_POLL_INTERVAL seconds. Each gunicorn worker has its own registry,
+so POST /admin/ops/providers/reload goes through the same file: it touches
+LLM_CONFIG_FILE and every worker's watcher picks the change up.
+"""
 from __future__ import annotations
-import os, logging
-from typing import Dict, Optional
+import os, logging, threading, time
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Tuple
 from .base import LLMClient
 from .azure_openai import AzureOpenAIClient
 from .openai import OpenAIClient
 from .anthropic import AnthropicClient
 from .gemini import GeminiClient
-from dotenv import load_dotenv
+from . import router as model_router
+from .. import metrics
+from dotenv import load_dotenv, dotenv_values
 
 log = logging.getLogger(__name__)
 
 load_dotenv()
 
-_REGISTRY: Dict[str, LLMClient] = {}
-_ACTIVE: Optional[str] = None
+CONFIG_FILE = os.getenv("LLM_CONFIG_FILE")
+CONFIG_POLL_INTERVAL = float(os.getenv("LLM_CONFIG_POLL_INTERVAL", "5"))
+DRAIN_TIMEOUT = float(os.getenv("LLM_RELOAD_DRAIN_TIMEOUT", "600"))
+
+reloads = metrics.counter(
+    "fauxllama_provider_reloads_total",
+    "Provider configuration reloads by result.",
+    ["result"],
+)
+draining = metrics.gauge(
+    "fauxllama_provider_draining_clients",
+    "Retired provider clients waiting for in-flight calls to finish.",
+)
+
+
+class ReloadUnavailable(RuntimeError):
+    pass
+
+
+class _State(NamedTuple):
+    clients: Dict[str, LLMClient]
+    active: Optional[str]
+    generation: int
+
+
+# Replaced wholesale, never mutated, so readers see either the old or the new set
+_STATE = _State({}, None, 0)
+_RETIRED: List[LLMClient] = []
+_LAST_RELOAD: Dict[str, Any] = {}
+_LOCK = threading.Lock()
+_RELOAD_LOCK = threading.Lock()
+_WATCHER: Optional[threading.Thread] = None
 
 def register(client: LLMClient) -> None:
-    _REGISTRY[client.name] = client
+    global _STATE
+    with _LOCK:
+        _STATE = _STATE._replace(clients={**_STATE.clients, client.name: client})
 
 def get(provider: str) -> LLMClient:
+    clients = _STATE.clients
     try:
-        return _REGISTRY[provider]
+        return clients[provider]
     except KeyError:
-        raise ValueError(f"Unknown provider '{provider}'. Registered: {list(_REGISTRY)}")
+        raise ValueError(f"Unknown provider '{provider}'. Registered: {list(clients)}")
 
-def _can_bootstrap(name: str) -> bool:
+def load_config() -> Dict[str, str]:
+    """The process environment, overridden by LLM_CONFIG_FILE when set."""
+    env = dict(os.environ)
+    if CONFIG_FILE:
+        env.update({k: v for k, v in dotenv_values(CONFIG_FILE).items() if v is not None})
+    return env
+
+def _can_bootstrap(name: str, env: Mapping[str, str]) -> bool:
     if name == "azure":
         need = ("AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_KEY", "AZURE_OPENAI_DEPLOYMENT")
-        return all(os.getenv(k) for k in need)
-    
+        return all(env.get(k) for k in need)
+
     elif name == "openai":
         need = ("OPENAI_API_KEY", "OPENAI_MODEL")
-        return all(os.getenv(k) for k in need)
-    
+        return all(env.get(k) for k in need)
+
     elif name == "anthropic":
         return True # Not implemented
-    
+
     elif name == "gemini":
         return True # Not implemented
 
-def _try_init(name: str) -> Optional[LLMClient]:
+def _try_init(name: str, env: Mapping[str, str]) -> Optional[LLMClient]:
     try:
-        if name == "azure" and _can_bootstrap("azure"):
-            c = AzureOpenAIClient()
+        if name == "azure" and _can_bootstrap("azure", env):
+            c = AzureOpenAIClient(env)
             c.validate()
             return c
-        if name == "openai" and _can_bootstrap("openai"):
-            c = OpenAIClient()
+        if name == "openai" and _can_bootstrap("openai", env):
+            c = OpenAIClient(env)
             c.validate()
             return c
     except Exception as e:
         log.warning("Provider %s failed validation: %s", name, e)
     return None
 
+def build_clients(env: Mapping[str, str]) -> Tuple[Dict[str, LLMClient], str]:
+    """Construct and validate every provider `env` configures. Raises if LLM_PROVIDER is unavailable."""
+    clients: Dict[str, LLMClient] = {}
+    try:
+        # Azure
+        if _can_bootstrap("azure", env): client = AzureOpenAIClient(env); client.validate(); clients[client.name] = client
+        # OpenAI
+        if _can_bootstrap("openai", env): client = OpenAIClient(env); client.validate(); clients[client.name] = client
+        # Anthropic
+        if _can_bootstrap("anthropic", env): client = AnthropicClient(); client.validate(); clients[client.name] = client
+        # Gemini
+        if _can_bootstrap("gemini", env): client = GeminiClient(); client.validate(); clients[client.name] = client
+
+        wanted = (env.get("LLM_PROVIDER") or "").strip().lower()
+        if not wanted or wanted not in clients:
+            raise RuntimeError(
+                "No LLM provider available. Set LLM_PROVIDER and provider-specific .env variables."
+            )
+    except Exception:
+        _close_all(list(clients.values()))
+        raise
+    return clients, wanted
+
+def _warm(client: LLMClient) -> None:
+    try:
+        client.warm()
+    except Exception as e:
+        log.warning("Provider %s failed to pre-warm connections: %s", client.name, e)
+
+def _close_all(clients: List[LLMClient]) -> None:
+    for c in clients:
+        try:
+            c.close()
+        except Exception as e:
+            log.warning("Closing provider %s failed: %s", c.name, e)
+
 def auto_register_llm_from_env() -> None:
     """Register providers that have enough env config present."""
-    
-    # Azure
-    if _can_bootstrap("azure"): client = None; client = AzureOpenAIClient(); client.validate(); register(client)
-    # OpenAI
-    if _can_bootstrap("openai"):  client = None; client = OpenAIClient(); client.validate(); register(client)
-    # Anthropic
-    if _can_bootstrap("anthropic"):  client = None; client = AnthropicClient(); client.validate(); register(client)
-    # Gemini
-    if _can_bootstrap("gemini"):  client = None; client = GeminiClient(); client.validate(); register(client)
-    
-    global _ACTIVE
-    wanted = (os.getenv("LLM_PROVIDER") or "").strip().lower()
-    print("Provider selected:", wanted)
-    if wanted and wanted in _REGISTRY:
-        _ACTIVE = wanted
-
-    if not _ACTIVE:
-        raise RuntimeError(
-            "No LLM provider available. Set LLM_PROVIDER and provider-specific .env variables."
+    global _STATE
+    env = load_config()
+    print("Provider selected:", (env.get("LLM_PROVIDER") or "").strip().lower())
+    # Routes may live in LLM_CONFIG_FILE too, so build them from the same merged config
+    table = model_router.Router(model_router.load_table(env))
+    clients, active = build_clients(env)
+    with _LOCK:
+        _STATE = _State(clients, active, _STATE.generation + 1)
+    model_router.install(table)
+    _warm(clients[active])
+    _start_watcher()
+
+def reload() -> Dict[str, Any]:
+    """
+    Rebuild providers and the routing table from fresh config and swap them in.
+
+    Everything is built, validated and warmed before the swap; on any failure
+    the current clients stay active and the error is reported.
+    """
+    global _STATE, _LAST_RELOAD
+    with _RELOAD_LOCK:
+        started = time.monotonic()
+        try:
+            env = load_config()
+            table = model_router.Router(model_router.load_table(env))
+            clients, active = build_clients(env)
+        except Exception as e:
+            log.error("Provider reload failed; keeping current configuration: %s", e)
+            reloads.inc(result="error")
+            _LAST_RELOAD = {"ok": False, "error": str(e), "at": time.time()}
+            return status()
+        _warm(clients[active])
+
+        with _LOCK:
+            retired = list(_STATE.clients.values())
+            _STATE = _State(clients, active, _STATE.generation + 1)
+            _RETIRED.extend(retired)
+            draining.set(len(_RETIRED))
+        model_router.install(table)
+        threading.Thread(target=_drain, args=(retired,), name="provider-drain", daemon=True).start()
+
+        reloads.inc(result="ok")
+        _LAST_RELOAD = {"ok": True, "seconds": round(time.monotonic() - started, 3), "at": time.time()}
+        log.info("Providers reloaded (generation %d, active=%s, registered=%s)",
+                 _STATE.generation, active, list(clients))
+        return status()
+
+def reload_all_workers() -> float:
+    """
+    Ask every worker to reload by touching LLM_CONFIG_FILE; returns the signal time.
+
+    Raises ReloadUnavailable when there is no watched config file to signal through.
+    """
+    if not CONFIG_FILE or CONFIG_POLL_INTERVAL <= 0:
+        raise ReloadUnavailable(
+            "Reloading every worker needs LLM_CONFIG_FILE and LLM_CONFIG_POLL_INTERVAL > 0"
         )
+    signalled = time.time()
+    try:
+        os.utime(CONFIG_FILE)
+    except OSError as e:
+        raise ReloadUnavailable(f"Cannot signal workers through {CONFIG_FILE}: {e}")
+    return signalled
+
+def wait_for_reload(since: float, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """This worker's status once it has reloaded after `since`, or None on timeout."""
+    deadline = time.monotonic() + (CONFIG_POLL_INTERVAL * 2 + 5 if timeout is None else timeout)
+    while time.monotonic() < deadline:
+        if (_LAST_RELOAD.get("at") or 0) >= since:
+            return status()
+        time.sleep(0.2)
+    return None
+
+def _drain(clients: List[LLMClient]) -> None:
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    pending = list(clients)
+    while pending:
+        expired = time.monotonic() >= deadline
+        for c in [c for c in pending if expired or c.inflight == 0]:
+            if c.inflight:
+                log.warning("Closing retired provider %s with %d calls still in flight", c.name, c.inflight)
+            _close_all([c])
+            pending.remove(c)
+            with _LOCK:
+                _RETIRED.remove(c)
+                draining.set(len(_RETIRED))
+        if pending:
+            time.sleep(0.5)
+
+def _watch_config(path: str, interval: float) -> None:
+    def mtime() -> Optional[float]:
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    last = mtime()
+    while True:
+        time.sleep(interval)
+        current = mtime()
+        if current != last:
+            last = current
+            log.info("%s changed; reloading providers", path)
+            reload()
+
+def _start_watcher() -> None:
+    global _WATCHER
+    if not CONFIG_FILE or CONFIG_POLL_INTERVAL <= 0 or _WATCHER is not None:
+        return
+    _WATCHER = threading.Thread(target=_watch_config, args=(CONFIG_FILE, CONFIG_POLL_INTERVAL),
+                                name="provider-config-watcher", daemon=True)
+    _WATCHER.start()
+
+def status() -> Dict[str, Any]:
+    state = _STATE
+    return {
+        "generation": state.generation,
+        "active": state.active,
+        "registered": list(state.clients),
+        "draining": [{"provider": c.name, "inflight": c.inflight} for c in list(_RETIRED)],
+        "config_file": CONFIG_FILE,
+        "last_reload": _LAST_RELOAD or None,
+    }
 
 
 def active_provider() -> LLMClient:
-    assert _ACTIVE, "Registry not initialized. Call auto_register_llm_from_env() once at startup."
-    return _REGISTRY[_ACTIVE]
+    state = _STATE
+    assert state.active, "Registry not initialized. Call auto_register_llm_from_env() once at startup."
+    return state.clients[state.active]
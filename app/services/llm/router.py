@@ -0,0 +1,179 @@
+"""
+Request-aware model routing.
+
+Maps the `model` a client asks for to a registered provider and a concrete
+deployment/model, and optionally downgrades cheap requests (short prompts,
+no tools) to a smaller, faster model. The table is read from LLM_ROUTES_FILE
+(JSON) or the LLM_ROUTES env var:
+
+    {
+      "default": "gpt-4o",
+      "models": [
+        {"name": "gpt-4o",      "provider": "azure",  "deployment": "gpt-4o-prod"},
+        {"name": "gpt-4o-mini", "provider": "openai", "model": "gpt-4o-mini"}
+      ],
+      "rules": [
+        {"when": {"models": ["gpt-4o"], "max_prompt_chars": 2000, "tools": false},
+         "route_to": "gpt-4o-mini"}
+      ]
+    }
+
+Rules are evaluated in order and the first match wins. Without a table every
+request goes to the active provider with its configured deployment/model.
+
+A model may list several equivalent deployments (`"deployment": ["a", "b"]`);
+Route.pick() spreads users across them but keeps each one on the same
+deployment so its upstream prompt cache stays warm.
+
+Entries with `"kind": "embedding"` map embedding model names instead; they
+are only used by the embedding endpoints and never resolve chat requests:
+
+    {"name": "text-embedding-3-large", "kind": "embedding",
+     "provider": "azure", "deployment": "embed-large-prod"}
+"""
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from cachetools import TTLCache
+
+from .base import ChatMessage, ModelParams
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Route:
+    name: str
+    provider: Optional[str]        # None -> active provider
+    target: Optional[str] = None   # deployment (azure) or model (openai); None -> provider default
+    reason: str = "default"
+    targets: Tuple[str, ...] = ()  # several equivalent deployments; see pick()
+
+    def pick(self, affinity: Optional[str]) -> Optional[str]:
+        """
+        Sticky choice among `targets` by rendezvous hashing on `affinity`, so
+        repeat prompts land on the deployment whose prompt cache is warm and
+        removing one deployment only moves the keys that were on it.
+        """
+        if len(self.targets) < 2 or not affinity:
+            return self.target
+        return max(self.targets, key=lambda t: hashlib.sha256(f"{affinity}:{t}".encode("utf-8")).digest())
+
+
+class Router:
+    def __init__(self, table: Optional[Dict[str, Any]] = None) -> None:
+        table = table or {}
+        self.models: Dict[str, Route] = {}
+        self.embeddings: Dict[str, Route] = {}
+        for m in table.get("models", []):
+            kind = m.get("kind") or "chat"
+            if kind not in ("chat", "embedding"):
+                raise ValueError(f"Model {m.get('name')!r} has unknown kind {kind!r}")
+            target = m.get("deployment") or m.get("model")
+            targets = tuple(target) if isinstance(target, list) else ()
+            routes = self.embeddings if kind == "embedding" else self.models
+            routes[m["name"]] = Route(
+                name=m["name"],
+                provider=m.get("provider"),
+                target=targets[0] if targets else target,
+                targets=targets,
+            )
+        self.default = table.get("default") or next(iter(self.models), None)
+        self.rules: List[Dict[str, Any]] = table.get("rules", [])
+        for rule in self.rules:
+            if rule.get("route_to") not in self.models:
+                raise ValueError(f"Routing rule targets unknown model {rule.get('route_to')!r}")
+        self._cache: TTLCache = TTLCache(maxsize=4096, ttl=300)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.models)
+
+    def model_names(self) -> List[str]:
+        return list(self.models)
+
+    def embedding_route(self, requested: Optional[str]) -> Optional[Route]:
+        """The `"kind": "embedding"` entry for `requested`, or None for the provider default."""
+        return self.embeddings.get(requested or "")
+
+    def resolve(self, requested: Optional[str], messages: List[ChatMessage],
+                params: Optional[ModelParams] = None) -> Route:
+        if not self.enabled:
+            return Route(name=requested or "default", provider=None)
+
+        key = _fingerprint(requested, messages, params)
+        route = self._cache.get(key)
+        if route is not None:
+            return route
+
+        prompt_chars, has_tools = key[1], key[2]
+        base = self.models.get(requested or "") or self.models.get(self.default or "")
+        if base is None:
+            raise ValueError(f"Unknown model {requested!r}. Available: {self.model_names()}")
+        route = replace(base, reason="requested" if base.name == requested else "default")
+
+        for i, rule in enumerate(self.rules):
+            if _matches(rule.get("when", {}), route.name, prompt_chars, has_tools):
+                route = replace(self.models[rule["route_to"]], reason=f"rule[{i}]")
+                break
+
+        self._cache[key] = route
+        log.info(
+            "Routing model=%s prompt_chars=%d tools=%s -> %s (provider=%s target=%s, %s)",
+            requested, prompt_chars, has_tools, route.name, route.provider, route.target, route.reason,
+        )
+        return route
+
+
+def _fingerprint(requested: Optional[str], messages: List[ChatMessage],
+                 params: Optional[ModelParams]) -> Tuple[Optional[str], int, bool]:
+    """The request features routing depends on; equal fingerprints route identically."""
+    prompt_chars = sum(len(m.get("content") or "") if isinstance(m.get("content"), str)
+                       else len(json.dumps(m.get("content"))) for m in messages)
+    has_tools = bool((params or {}).get("tools"))
+    return requested, prompt_chars, has_tools
+
+
+def _matches(when: Dict[str, Any], model: str, prompt_chars: int, has_tools: bool) -> bool:
+    if "models" in when and model not in when["models"]:
+        return False
+    if "max_prompt_chars" in when and prompt_chars > when["max_prompt_chars"]:
+        return False
+    if "min_prompt_chars" in when and prompt_chars < when["min_prompt_chars"]:
+        return False
+    if "tools" in when and has_tools != bool(when["tools"]):
+        return False
+    return True
+
+
+def load_table(env: Optional[Mapping[str, str]] = None) -> Optional[Dict[str, Any]]:
+    env = os.environ if env is None else env
+    path = env.get("LLM_ROUTES_FILE")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    inline = env.get("LLM_ROUTES")
+    if inline:
+        return json.loads(inline)
+    return None
+
+
+_ROUTER: Optional[Router] = None
+
+
+def router() -> Router:
+    global _ROUTER
+    if _ROUTER is None:
+        _ROUTER = Router(load_table())
+    return _ROUTER
+
+
+def install(new: Router) -> None:
+    """Replace the routing table (used by provider reloads)."""
+    global _ROUTER
+    _ROUTER = new
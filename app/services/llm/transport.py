@@ -0,0 +1,264 @@
+"""
+Shared HTTP plumbing for provider clients.
+
+`build_session()` returns a requests.Session whose connection pool is sized for
+gevent concurrency (default pool_maxsize=10 would open and discard a fresh
+TCP+TLS connection for every concurrent stream beyond ten) and instrumented so
+that pool hits, misses, discarded connections and handshake times are exported.
+With LLM_HTTP2=true and httpx[http2] installed, an httpx-backed session that
+multiplexes streams over HTTP/2 is returned instead.
+
+`ConnectionWarmer` opens keep-alive connections ahead of traffic at startup
+and again after idle periods.
+
+Env (per provider prefix, e.g. AZURE_OPENAI_POOL_MAXSIZE, falling back to LLM_HTTP_*):
+  - *_POOL_MAXSIZE          connections kept per upstream host (default 100)
+  - *_PREWARM               connections opened ahead of traffic (default 4)
+  - *_KEEPALIVE_INTERVAL    seconds of idleness before re-warming (default 60, 0 disables)
+  - LLM_HTTP2               use HTTP/2 via httpx when available (default false)
+"""
+from __future__ import annotations
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Mapping, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter, Retry
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from .. import metrics
+
+log = logging.getLogger(__name__)
+
+pool_requests = metrics.counter(
+    "fauxllama_upstream_pool_requests_total",
+    "Upstream connection checkouts; result=hit reused a live keep-alive connection.",
+    ["provider", "result"],
+)
+pool_discarded = metrics.counter(
+    "fauxllama_upstream_pool_discarded_total",
+    "Upstream connections closed because the pool was full.",
+    ["provider"],
+)
+handshake_seconds = metrics.histogram(
+    "fauxllama_upstream_handshake_seconds",
+    "TCP+TLS connect time for new upstream connections.",
+    ["provider"],
+)
+
+
+def env_setting(prefix: str, name: str, default: str, env: Optional[Mapping[str, str]] = None) -> str:
+    env = os.environ if env is None else env
+    return env.get(f"{prefix}_{name}") or env.get(f"LLM_HTTP_{name}") or default
+
+
+def _instrumented_pools(provider: str) -> Dict[str, type]:
+    def timed_connect(base: type) -> type:
+        class TimedConnection(base):  # type: ignore[misc, valid-type]
+            def connect(self) -> None:
+                start = time.perf_counter()
+                super().connect()
+                handshake_seconds.observe(time.perf_counter() - start, provider=provider)
+        return TimedConnection
+
+    def counted(base: type, conn_cls: type) -> type:
+        class CountedPool(base):  # type: ignore[misc, valid-type]
+            ConnectionCls = conn_cls
+
+            def _get_conn(self, timeout: Optional[float] = None) -> Any:
+                conn = super()._get_conn(timeout)
+                reused = getattr(conn, "sock", None) is not None
+                pool_requests.inc(provider=provider, result="hit" if reused else "miss")
+                return conn
+
+            def _put_conn(self, conn: Any) -> None:
+                if conn is not None and self.pool is not None and self.pool.full():
+                    pool_discarded.inc(provider=provider)
+                super()._put_conn(conn)
+        return CountedPool
+
+    return {
+        "http": counted(HTTPConnectionPool, timed_connect(HTTPConnection)),
+        "https": counted(HTTPSConnectionPool, timed_connect(HTTPSConnection)),
+    }
+
+
+class InstrumentedHTTPAdapter(HTTPAdapter):
+    def __init__(self, provider: str, **kwargs: Any) -> None:
+        self.provider = provider
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = _instrumented_pools(self.provider)
+
+
+class _H2Response:
+    """Just enough of requests.Response over an httpx streaming response."""
+
+    def __init__(self, resp: Any) -> None:
+        self._resp = resp
+
+    @property
+    def status_code(self) -> int:
+        return self._resp.status_code
+
+    @property
+    def text(self) -> str:
+        self._resp.read()
+        return self._resp.text
+
+    def raise_for_status(self) -> None:
+        if self._resp.status_code >= 400:
+            self._resp.read()
+            raise requests.HTTPError(
+                f"{self._resp.status_code} Error: {self._resp.reason_phrase} for url: {self._resp.url}",
+                response=None,
+            )
+
+    def json(self) -> Any:
+        self._resp.read()
+        return self._resp.json()
+
+    def iter_lines(self) -> Iterator[bytes]:
+        for line in self._resp.iter_lines():
+            yield line.encode("utf-8")
+
+    def close(self) -> None:
+        self._resp.close()
+
+    def __enter__(self) -> "_H2Response":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+class H2Session:
+    """requests-like session multiplexing upstream streams over HTTP/2 (httpx)."""
+
+    def __init__(self, provider: str, pool_maxsize: int, retries: int) -> None:
+        import httpx
+
+        self.provider = provider
+        self._client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize),
+            transport=httpx.HTTPTransport(http2=True, retries=retries),
+        )
+
+    def request(self, method: str, url: str, headers: Optional[Dict[str, str]] = None,
+                params: Optional[Dict[str, Any]] = None, json: Any = None, stream: bool = False,
+                timeout: Tuple[float, float] = (5, 300)) -> _H2Response:
+        import httpx
+
+        req = self._client.build_request(
+            method, url, headers=headers, params=params, json=json,
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+        )
+        resp = self._client.send(req, stream=True)
+        if not stream:
+            resp.read()
+        return _H2Response(resp)
+
+    def get(self, url: str, **kwargs: Any) -> _H2Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> _H2Response:
+        return self.request("POST", url, **kwargs)
+
+    def close(self) -> None:
+        self._client.close()
+
+
+def build_session(provider: str, env_prefix: str, retries: Retry,
+                  env: Optional[Mapping[str, str]] = None) -> Any:
+    env = os.environ if env is None else env
+    pool_maxsize = int(env_setting(env_prefix, "POOL_MAXSIZE", "100", env))
+    http2 = env.get(f"{env_prefix}_HTTP2") or env.get("LLM_HTTP2", "false")
+    if http2.strip().lower() in ("1", "true", "yes", "on"):
+        try:
+            import h2  # noqa: F401
+            return H2Session(provider, pool_maxsize, retries.total or 0)
+        except ImportError:
+            log.warning("HTTP/2 requested for %s but httpx[http2] is not installed; using HTTP/1.1", provider)
+
+    session = requests.Session()
+    adapter = InstrumentedHTTPAdapter(
+        provider,
+        pool_connections=int(env_setting(env_prefix, "POOL_CONNECTIONS", "10", env)),
+        pool_maxsize=pool_maxsize,
+        max_retries=retries,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class ConnectionWarmer:
+    """
+    Keeps `size` keep-alive connections open to an upstream.
+
+    `request` performs one cheap authenticated request (e.g. GET /models);
+    warm() runs `size` of them concurrently so that distinct connections end
+    up idle in the pool. Providers call touch() on each real request; the
+    keep-alive loop re-warms once the upstream has been idle for `interval`.
+    """
+
+    def __init__(self, provider: str, request: Callable[[], Any], size: int, interval: float) -> None:
+        self.provider = provider
+        self._request = request
+        self.size = size
+        self.interval = interval
+        self._last_used = 0.0
+        self._started = False
+        self._stopped = threading.Event()
+
+    @classmethod
+    def from_env(cls, provider: str, env_prefix: str, request: Callable[[], Any],
+                 env: Optional[Mapping[str, str]] = None) -> "ConnectionWarmer":
+        return cls(
+            provider,
+            request,
+            size=int(env_setting(env_prefix, "PREWARM", "4", env)),
+            interval=float(env_setting(env_prefix, "KEEPALIVE_INTERVAL", "60", env)),
+        )
+
+    def touch(self) -> None:
+        self._last_used = time.monotonic()
+
+    def warm(self) -> None:
+        if self.size <= 0:
+            return
+        threads = [threading.Thread(target=self._one, daemon=True) for _ in range(self.size)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.touch()
+
+    def _one(self) -> None:
+        try:
+            resp = self._request()
+            resp.close()
+        except Exception as e:
+            log.debug("Warm-up request to %s failed: %s", self.provider, e)
+
+    def start(self) -> None:
+        """Warm now, then keep warming after idle periods."""
+        self.warm()
+        if self._started or self.interval <= 0:
+            return
+        self._started = True
+        threading.Thread(target=self._keepalive, name=f"warmer-{self.provider}", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _keepalive(self) -> None:
+        while not self._stopped.wait(self.interval):
+            if time.monotonic() - self._last_used >= self.interval:
+                self.warm()
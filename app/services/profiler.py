@@ -0,0 +1,192 @@
+"""
+On-demand profiling for a running worker (exposed under /admin/ops/profile).
+
+`sample()` runs a statistical sampler for a few seconds and returns the
+stacks in the collapsed format used by flamegraph.pl / speedscope:
+
+    gevent;handle (routes.py:101);dumps (__init__.py:183) 42
+
+Under the gevent worker every greenlet runs on the main OS thread, so the
+sampler itself must be a real OS thread: it is started with the unpatched
+`_thread` primitives, reads `sys._current_frames()` every 1/hz seconds and
+never yields to the hub. Time spent idle in the gevent hub shows up under the
+hub's `run` frame.
+
+`timed()` wraps a hot-path function with a timing hook that records
+`fauxllama_hook_seconds{hook}` while hooks are enabled (PROFILE_HOOKS or the
+admin toggle). For functions returning an iterator, the time spent inside
+`next()` is summed over the whole stream. When disabled the hook costs one
+flag check.
+"""
+from __future__ import annotations
+import _thread
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Iterator, Tuple, TypeVar
+
+from . import metrics
+
+SAMPLE_HZ = float(os.getenv("PROFILE_SAMPLE_HZ", "100"))
+MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+MAX_DEPTH = 128
+
+hooks_enabled = (os.getenv("PROFILE_HOOKS") or "false").strip().lower() in ("1", "true", "yes", "on")
+
+hook_seconds = metrics.histogram(
+    "fauxllama_hook_seconds",
+    "Wall time spent inside instrumented hot-path functions (profiling hooks).",
+    ["hook"],
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 300.0),
+)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+_busy = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _os_thread_primitives() -> Tuple[Callable[..., Any], Callable[[float], None], Callable[[], int], bool]:
+    """start_new_thread, sleep and get_ident that bypass gevent's monkey-patching, and whether it is active."""
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched("threading"):
+            return (monkey.get_original("_thread", "start_new_thread"),
+                    monkey.get_original("time", "sleep"),
+                    monkey.get_original("_thread", "get_ident"),
+                    True)
+    except ImportError:
+        pass
+    return _thread.start_new_thread, time.sleep, _thread.get_ident, False
+
+
+def _frame_label(frame: Any) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler:
+    def __init__(self, hz: float = SAMPLE_HZ) -> None:
+        self.interval = 1.0 / max(1.0, min(hz, 1000.0))
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = False
+        self.done = False
+
+    def run(self, sleep: Callable[[float], None], get_ident: Callable[[], int],
+            names: Dict[int, str]) -> None:
+        me = get_ident()
+        names = {**{t.ident: t.name for t in threading.enumerate()}, **names}
+        try:
+            while not self._stop:
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    labels = []
+                    while frame is not None and len(labels) < MAX_DEPTH:
+                        labels.append(_frame_label(frame))
+                        frame = frame.f_back
+                    labels.append(names.get(ident) or f"thread-{ident}")
+                    self.stacks[";".join(reversed(labels))] += 1
+                self.samples += 1
+                sleep(self.interval)
+        finally:
+            self.done = True
+
+    def stop(self) -> None:
+        self._stop = True
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+
+def sample(seconds: float, hz: float = SAMPLE_HZ) -> Sampler:
+    """Sample all threads of this worker for `seconds`. Raises ProfilerBusy if a run is in progress."""
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already being collected in this worker")
+    try:
+        start_new_thread, real_sleep, get_ident, patched = _os_thread_primitives()
+        sampler = Sampler(hz)
+        # Under gevent, thread names map to greenlets; label the OS thread they share
+        names = {get_ident(): "gevent"} if patched else {}
+        start_new_thread(sampler.run, (real_sleep, get_ident, names))
+        # time.sleep is cooperative under gevent, so other requests keep being
+        # served (and sampled) while this one waits
+        time.sleep(max(0.0, min(seconds, MAX_SECONDS)))
+        sampler.stop()
+        while not sampler.done:
+            time.sleep(0.01)
+        return sampler
+    finally:
+        _busy.release()
+
+
+def set_hooks(enabled: bool) -> None:
+    global hooks_enabled
+    hooks_enabled = enabled
+
+
+class _TimedIterator:
+    """Sums the time spent producing items; observed once the stream ends or is closed."""
+
+    def __init__(self, hook: str, it: Iterator[Any], elapsed: float) -> None:
+        self._hook = hook
+        self._it = it
+        self._elapsed = elapsed
+        self._observed = False
+
+    def __iter__(self) -> "_TimedIterator":
+        return self
+
+    def __next__(self) -> Any:
+        t0 = time.perf_counter()
+        try:
+            item = next(self._it)
+        except BaseException:
+            self._elapsed += time.perf_counter() - t0
+            self._observe()
+            raise
+        self._elapsed += time.perf_counter() - t0
+        return item
+
+    def close(self) -> None:
+        close = getattr(self._it, "close", None)
+        if close is not None:
+            close()
+        self._observe()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._it, name)
+
+    def _observe(self) -> None:
+        if not self._observed:
+            self._observed = True
+            hook_seconds.observe(self._elapsed, hook=self._hook)
+
+
+def timed(hook: str) -> Callable[[F], F]:
+    def decorator(fn: F) -> F:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not hooks_enabled:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            result = fn(*args, **kwargs)
+            elapsed = time.perf_counter() - t0
+            if hasattr(result, "__next__"):
+                return _TimedIterator(hook, result, elapsed)
+            hook_seconds.observe(elapsed, hook=hook)
+            return result
+        return wrapper  # type: ignore[return-value]
+    return decorator
+
+
+def status() -> Dict[str, Any]:
+    return {"hooks_enabled": hooks_enabled, "sample_hz": SAMPLE_HZ, "max_seconds": MAX_SECONDS,
+            "profiling": _busy.locked()}
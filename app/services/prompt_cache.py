@@ -0,0 +1,115 @@
+"""
+Prompt-cache-aware request preparation and cached-token accounting.
+
+Upstream prompt caches (OpenAI, Azure OpenAI) match on an exact token prefix
+and route by a prefix hash, so `prepare()` runs before `stream_chat` and:
+
+  - keeps the tool definitions byte-stable: sorted by name with their JSON
+    schema keys sorted;
+  - derives an affinity key per user or per conversation prefix
+    (PROMPT_CACHE_SCOPE=user|conversation|off). It is sent as
+    `prompt_cache_key` to providers that accept it and is also used to pick a
+    sticky deployment when a route lists several (see Route.pick);
+  - asks for `stream_options.include_usage` so the final chunk reports
+    `usage.prompt_tokens_details.cached_tokens`. The usage-only chunk is not
+    forwarded to clients that did not request it.
+
+Providers call `observe_usage()` on that chunk, which exports prompt, cached
+and completion token counters per provider and model.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from . import metrics
+from .llm.base import ChatMessage, LLMClient, ModelParams, StreamEvent
+
+SCOPE = (os.getenv("PROMPT_CACHE_SCOPE") or "user").strip().lower()  # user | conversation | off
+
+prompt_tokens = metrics.counter(
+    "fauxllama_prompt_tokens_total",
+    "Prompt tokens reported by the upstream.",
+    ["provider", "model"],
+)
+cached_tokens = metrics.counter(
+    "fauxllama_prompt_cached_tokens_total",
+    "Prompt tokens served from the upstream prompt cache.",
+    ["provider", "model"],
+)
+completion_tokens = metrics.counter(
+    "fauxllama_completion_tokens_total",
+    "Completion tokens reported by the upstream.",
+    ["provider", "model"],
+)
+
+
+@dataclass
+class Prepared:
+    messages: List[ChatMessage]
+    params: ModelParams
+    affinity: Optional[str]
+    forward_usage: bool
+
+
+def _canonical(value: Any) -> Any:
+    return json.loads(json.dumps(value, sort_keys=True, ensure_ascii=False))
+
+
+def stable_tools(tools: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def name(tool: Dict[str, Any]) -> str:
+        return str((tool.get("function") or {}).get("name") or tool.get("name") or "")
+    return [_canonical(t) for t in sorted(tools, key=name)]
+
+
+def affinity_key(username: str, messages: List[ChatMessage], model: Optional[str]) -> Optional[str]:
+    if SCOPE == "off":
+        return None
+    parts = [username, model or ""]
+    if SCOPE == "conversation" and messages:
+        first = messages[0].get("content")
+        parts.append(first if isinstance(first, str) else json.dumps(first, sort_keys=True, ensure_ascii=False))
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()[:32]
+
+
+def prepare(client: LLMClient, username: str, messages: List[ChatMessage],
+            params: Optional[ModelParams], model: Optional[str]) -> Prepared:
+    params = dict(params or {})
+    if isinstance(params.get("tools"), list):
+        params["tools"] = stable_tools(params["tools"])
+
+    affinity = affinity_key(username, messages, model)
+    if affinity and client.supports_prompt_cache_key and "prompt_cache_key" not in params:
+        params["prompt_cache_key"] = affinity
+
+    stream_options = dict(params.get("stream_options") or {})
+    forward_usage = bool(stream_options.get("include_usage"))
+    if client.supports_stream_usage and not forward_usage:
+        stream_options["include_usage"] = True
+        params["stream_options"] = stream_options
+    return Prepared(messages, params, affinity, forward_usage)
+
+
+def is_usage_only(ev: StreamEvent) -> bool:
+    return bool(ev.get("usage")) and not ev.get("choices")
+
+
+def usage_attrs(usage: Dict[str, Any]) -> Dict[str, int]:
+    details = usage.get("prompt_tokens_details") or {}
+    return {
+        "prompt_tokens": int(usage.get("prompt_tokens") or 0),
+        "cached_tokens": int(details.get("cached_tokens") or 0),
+        "completion_tokens": int(usage.get("completion_tokens") or 0),
+    }
+
+
+def observe_usage(provider: str, model: Optional[str], usage: Optional[Dict[str, Any]]) -> None:
+    if not usage:
+        return
+    attrs = usage_attrs(usage)
+    labels = {"provider": provider, "model": model or ""}
+    prompt_tokens.inc(attrs["prompt_tokens"], **labels)
+    cached_tokens.inc(attrs["cached_tokens"], **labels)
+    completion_tokens.inc(attrs["completion_tokens"], **labels)
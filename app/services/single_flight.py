@@ -0,0 +1,350 @@
+"""
+Single-flight coalescing of identical in-flight chat requests.
+
+Concurrent deterministic requests (temperature 0 or an explicit seed, n == 1)
+with the same fingerprint share one upstream stream. The stream runs in a
+background task and appends its events to an append-only log; every subscriber
+reads the log with its own cursor, so late joiners replay the chunks already
+emitted and slow subscribers never hold back fast ones. When the last
+subscriber leaves, the upstream response is closed.
+
+SINGLE_FLIGHT=off|local|redis. In redis mode (SINGLE_FLIGHT_REDIS_URL) the
+leader is elected with SET NX across workers and publishes its events to a
+Redis stream that followers in other workers replay.
+"""
+from __future__ import annotations
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from . import metrics, stream_guard
+from .llm.base import ChatMessage, LLMClient, ModelParams, StreamEvent
+
+log = logging.getLogger(__name__)
+
+MODE = (os.getenv("SINGLE_FLIGHT") or "local").strip().lower()
+REDIS_URL = os.getenv("SINGLE_FLIGHT_REDIS_URL") or os.getenv("RATELIMIT_STORAGE_URL")
+LOCK_TTL_MS = int(os.getenv("SINGLE_FLIGHT_LOCK_TTL_MS", "300000"))
+REMOTE_IDLE_TIMEOUT_MS = int(os.getenv("SINGLE_FLIGHT_REMOTE_IDLE_TIMEOUT_MS", "30000"))
+
+_WORKER_ID = uuid.uuid4().hex
+
+coalesced_requests = metrics.counter(
+    "fauxllama_single_flight_requests_total",
+    "Chat requests by single-flight role (leader, follower, remote_follower, bypass).",
+    ["role"],
+)
+active_flights = metrics.gauge(
+    "fauxllama_single_flight_active",
+    "Upstream streams currently shared through single-flight in this worker.",
+)
+cancelled_flights = metrics.counter(
+    "fauxllama_single_flight_cancelled_total",
+    "Shared upstream streams stopped because every local subscriber left.",
+)
+
+ABORTED_MESSAGE = "Coalesced upstream stream was aborted before completion"
+
+
+def is_deterministic(params: Optional[ModelParams]) -> bool:
+    params = params or {}
+    if params.get("n", 1) != 1:
+        return False
+    return params.get("temperature") == 0 or params.get("seed") is not None
+
+
+def fingerprint(provider: str, messages: List[ChatMessage], params: Optional[ModelParams],
+                model: Optional[str] = None) -> str:
+    # prompt_cache_key only steers upstream cache routing; it doesn't change the answer
+    params = {k: v for k, v in (params or {}).items() if k != "prompt_cache_key"}
+    body = json.dumps(
+        {"provider": provider, "model": model, "messages": messages, "params": params},
+        sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+class Flight:
+    def __init__(self, key: str, factory: Callable[[], Iterator[StreamEvent]],
+                 on_done: Callable[["Flight"], None], hold: Optional[Callable[[], None]] = None) -> None:
+        self.key = key
+        self.events: List[StreamEvent] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        # Subscriber disconnects are already counted by each request's own guard
+        self.guard = stream_guard.StreamGuard(count_aborts=False)
+        self._factory = factory
+        self._on_done = on_done
+        self._hold = hold
+        self._cond = threading.Condition()
+
+    def start(self) -> None:
+        ctx = contextvars.copy_context()
+        threading.Thread(target=ctx.run, args=(self._run,), name=f"single-flight-{self.key[:8]}",
+                         daemon=True).start()
+
+    def _run(self) -> None:
+        active_flights.inc()
+        upstream = None
+        try:
+            with stream_guard.activate(self.guard):
+                upstream = self._factory()
+                for ev in upstream:
+                    if self.guard.aborted:
+                        break
+                    with self._cond:
+                        self.events.append(ev)
+                        self._cond.notify_all()
+        except Exception as e:
+            if not self.guard.aborted:
+                self.error = e
+        finally:
+            if upstream is not None and hasattr(upstream, "close"):
+                upstream.close()
+            active_flights.dec()
+            if self._hold is not None:
+                self._hold()
+            with self._cond:
+                self.done = True
+                self._cond.notify_all()
+            self._on_done(self)
+
+    def subscribe(self) -> "Subscription":
+        with self._cond:
+            self.subscribers += 1
+        return Subscription(self)
+
+    def _leave(self) -> None:
+        with self._cond:
+            self.subscribers -= 1
+            last = self.subscribers <= 0 and not self.done
+        if last:
+            if self.guard.abort("all_subscribers_left"):
+                cancelled_flights.inc()
+            self._on_done(self)
+
+
+class Subscription:
+    """One subscriber's cursor over a Flight's event log."""
+
+    def __init__(self, flight: Flight) -> None:
+        self._flight = flight
+        self._cursor = 0
+        self._closed = False
+
+    def __iter__(self) -> "Subscription":
+        return self
+
+    def __next__(self) -> StreamEvent:
+        f = self._flight
+        with f._cond:
+            while self._cursor >= len(f.events) and not f.done and not self._closed:
+                f._cond.wait()
+            if self._closed:
+                raise StopIteration
+            if self._cursor < len(f.events):
+                ev = f.events[self._cursor]
+                self._cursor += 1
+                return ev
+            error = f.error
+        self.close()
+        if error is not None:
+            raise error
+        raise StopIteration
+
+    def close(self) -> None:
+        f = self._flight
+        with f._cond:
+            if self._closed:
+                return
+            self._closed = True
+            f._cond.notify_all()
+        f._leave()
+
+
+class SingleFlight:
+    def __init__(self, redis_url: Optional[str] = None) -> None:
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+        self._redis = None
+        if redis_url:
+            import redis
+            self._redis = redis.Redis.from_url(redis_url)
+
+    def stream(self, key: str, factory: Callable[[], Iterator[StreamEvent]],
+               hold: Optional[Callable[[], None]] = None) -> Subscription:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and not flight.guard.aborted:
+                coalesced_requests.inc(role="follower")
+                sub = flight.subscribe()
+                if hold is not None:
+                    hold()
+                return sub
+            role = "leader"
+            acquired = self._acquire(key) if self._redis is not None else None
+            if acquired is False:
+                role = "remote_follower"
+                factory = lambda: self._replay(key)  # noqa: E731
+                if hold is not None:
+                    hold()
+                    hold = None
+            elif acquired:
+                factory = self._publishing(key, factory)
+            flight = Flight(key, factory, self._forget, hold)
+            self._flights[key] = flight
+            sub = flight.subscribe()
+        coalesced_requests.inc(role=role)
+        flight.start()
+        return sub
+
+    def join(self, key: str) -> Optional[Subscription]:
+        """Subscribe to the flight for `key` if one is running here; never starts one."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None or flight.guard.aborted:
+                return None
+            return flight.subscribe()
+
+    def _forget(self, flight: Flight) -> None:
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    # --- cross-worker mode -------------------------------------------------
+
+    def _acquire(self, key: str) -> Optional[bool]:
+        """True if this worker leads, False if another does, None if Redis is unavailable."""
+        try:
+            return bool(self._redis.set(f"fauxllama:sf:lock:{key}", _WORKER_ID, nx=True, px=LOCK_TTL_MS))
+        except Exception:
+            log.warning("Single-flight Redis unavailable; coalescing locally", exc_info=True)
+            return None
+
+    def _publishing(self, key: str, factory: Callable[[], Iterator[StreamEvent]]
+                    ) -> Callable[[], Iterator[StreamEvent]]:
+        stream_key = f"fauxllama:sf:stream:{key}"
+
+        def run() -> Iterator[StreamEvent]:
+            error: Optional[str] = None
+            completed = False
+            upstream = factory()
+            try:
+                for i, ev in enumerate(upstream):
+                    self._xadd(stream_key, {"ev": json.dumps(ev, ensure_ascii=False)})
+                    if i == 0:
+                        # Don't leave the stream behind if this worker dies mid-flight
+                        self._expire(stream_key, LOCK_TTL_MS)
+                    yield ev
+                completed = True
+            except Exception as e:
+                error = str(e)
+                raise
+            finally:
+                if hasattr(upstream, "close"):
+                    upstream.close()
+                if completed:
+                    self._xadd(stream_key, {"end": "1", "error": ""})
+                else:
+                    # Closed early (local subscribers left) or failed: remote
+                    # followers must not mistake the partial answer for a full one
+                    self._xadd(stream_key, {"end": "1", "error": error or ABORTED_MESSAGE, "aborted": "1"})
+                self._expire(stream_key, 5000)
+                try:
+                    self._redis.delete(f"fauxllama:sf:lock:{key}")
+                except Exception:
+                    pass
+        return run
+
+    def _expire(self, stream_key: str, ttl_ms: int) -> None:
+        try:
+            self._redis.pexpire(stream_key, ttl_ms)
+        except Exception:
+            log.warning("Single-flight expire failed for %s", stream_key, exc_info=True)
+
+    def _xadd(self, stream_key: str, fields: Dict[str, str]) -> None:
+        try:
+            self._redis.xadd(stream_key, fields)
+        except Exception:
+            log.warning("Single-flight publish failed for %s", stream_key, exc_info=True)
+
+    def _replay(self, key: str) -> Iterator[StreamEvent]:
+        stream_key = f"fauxllama:sf:stream:{key}"
+        last_id = "0"
+        while True:
+            resp = self._redis.xread({stream_key: last_id}, block=REMOTE_IDLE_TIMEOUT_MS, count=100)
+            if not resp:
+                raise RuntimeError("Timed out waiting for the coalesced upstream stream")
+            for _, entries in resp:
+                for entry_id, fields in entries:
+                    last_id = entry_id
+                    fields = {_s(k): _s(v) for k, v in fields.items()}
+                    if fields.get("end"):
+                        if fields.get("aborted") or fields.get("error"):
+                            raise RuntimeError(fields.get("error") or ABORTED_MESSAGE)
+                        return
+                    yield json.loads(fields["ev"])
+
+
+def _s(value: Any) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+_GROUP: Optional[SingleFlight] = None
+_GROUP_LOCK = threading.Lock()
+
+
+def _group() -> SingleFlight:
+    global _GROUP
+    if _GROUP is None:
+        with _GROUP_LOCK:
+            if _GROUP is None:
+                _GROUP = SingleFlight(REDIS_URL if MODE == "redis" else None)
+    return _GROUP
+
+
+def join(client: LLMClient, messages: List[ChatMessage], params: Optional[ModelParams] = None,
+         model: Optional[str] = None) -> Optional[Subscription]:
+    """
+    Attach to an identical stream already in flight in this worker, or None.
+
+    Unlike stream_chat() this never becomes the leader, so callers can skip
+    admission control for the returned subscription and take a ticket otherwise.
+    """
+    if MODE == "off" or not is_deterministic(params):
+        return None
+    sub = _group().join(fingerprint(client.name, messages, params, model))
+    if sub is not None:
+        coalesced_requests.inc(role="follower")
+    return sub
+
+
+def stream_chat(client: LLMClient, messages: List[ChatMessage], params: Optional[ModelParams] = None,
+                request_id: Optional[str] = None, model: Optional[str] = None,
+                hold: Optional[Callable[[], None]] = None) -> Iterator[StreamEvent]:
+    """
+    Drop-in for client.stream_chat() that coalesces identical deterministic requests.
+
+    `hold` is called once the shared upstream stream this request starts has
+    ended, even if the request itself left earlier (e.g. an admission slot
+    share); it is called right away when the request follows or bypasses.
+    """
+    if MODE == "off" or not is_deterministic(params):
+        coalesced_requests.inc(role="bypass")
+        if hold is not None:
+            hold()
+        return client.stream_chat(messages, params=params, request_id=request_id, model=model)
+
+    key = fingerprint(client.name, messages, params, model)
+    sub = _group().stream(
+        key, lambda: client.stream_chat(messages, params=params, request_id=request_id, model=model), hold
+    )
+    # Wake this subscriber as soon as its own client disconnects
+    stream_guard.track(sub)
+    return sub
@@ -0,0 +1,157 @@
+"""
+Client-disconnect detection for streaming responses.
+
+A StreamGuard watches the client socket from a background watchdog (a greenlet
+under the gevent worker) while the upstream stream is being relayed. As soon as
+the peer closes the connection, every tracked upstream response is closed, which
+frees the pooled connection and stops the provider from generating further
+tokens. Provider clients register their responses with `track()`; the guard is
+made current for the duration of the stream with `activate()`.
+"""
+from __future__ import annotations
+import logging
+import os
+import select
+import socket
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator, List, Optional
+
+from . import metrics
+
+log = logging.getLogger(__name__)
+
+POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.25"))  # seconds, 0 disables the watchdog
+
+streams_aborted = metrics.counter(
+    "fauxllama_streams_aborted_total",
+    "Streams aborted before completion.",
+    ["reason"],
+)
+wasted_tokens = metrics.counter(
+    "fauxllama_stream_wasted_tokens_total",
+    "Completion chunks (~tokens) generated upstream for streams the client abandoned.",
+)
+
+_current: ContextVar[Optional["StreamGuard"]] = ContextVar("fauxllama_stream_guard", default=None)
+
+
+def client_socket(environ: dict) -> Optional[socket.socket]:
+    """The raw client socket exposed by gunicorn or the werkzeug dev server, if any."""
+    return environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+
+
+def peer_closed(sock: socket.socket) -> Optional[bool]:
+    """True if the peer has closed the connection, False if not, None if unknown."""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b""
+    except ValueError:
+        # e.g. SSL sockets refuse recv flags; fall back to noticing on write
+        return None
+    except OSError:
+        return True
+
+
+class StreamGuard:
+    def __init__(self, sock: Optional[socket.socket] = None, poll_interval: float = POLL_INTERVAL,
+                 count_aborts: bool = True) -> None:
+        self.sock = sock
+        self.poll_interval = poll_interval
+        # Internal guards (e.g. a shared single-flight upstream) keep their own metrics
+        self.count_aborts = count_aborts
+        self.reason: Optional[str] = None
+        self._closeables: List[Any] = []
+        self._callbacks: List[Callable[[str], None]] = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    @property
+    def aborted(self) -> bool:
+        return self.reason is not None
+
+    def track(self, closeable: Any) -> None:
+        """Close `closeable` on abort (immediately if already aborted)."""
+        with self._lock:
+            if not self.aborted:
+                self._closeables.append(closeable)
+                return
+        _close_quietly(closeable)
+
+    def untrack(self, closeable: Any) -> None:
+        with self._lock:
+            if closeable in self._closeables:
+                self._closeables.remove(closeable)
+
+    def on_abort(self, callback: Callable[[str], None]) -> None:
+        self._callbacks.append(callback)
+
+    def abort(self, reason: str = "client_disconnected") -> bool:
+        """Abort once; returns False if the guard was already aborted."""
+        with self._lock:
+            if self.aborted:
+                return False
+            self.reason = reason
+            closeables, self._closeables = self._closeables, []
+        self._stopped.set()
+        for c in closeables:
+            _close_quietly(c)
+        for cb in self._callbacks:
+            try:
+                cb(reason)
+            except Exception:
+                log.exception("Stream abort callback failed")
+        if self.count_aborts:
+            streams_aborted.inc(reason=reason)
+        return True
+
+    def start(self) -> "StreamGuard":
+        if self.sock is not None and self.poll_interval > 0:
+            threading.Thread(target=self._watch, name="stream-guard", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.poll_interval):
+            closed = peer_closed(self.sock)
+            if closed is None:
+                return
+            if closed:
+                log.info("Client disconnected; aborting upstream stream")
+                self.abort("client_disconnected")
+                return
+
+
+def _close_quietly(closeable: Any) -> None:
+    try:
+        closeable.close()
+    except Exception:
+        pass
+
+
+def current_guard() -> Optional[StreamGuard]:
+    return _current.get()
+
+
+def track(closeable: Any) -> None:
+    """Register an upstream response with the current guard, if any."""
+    guard = _current.get()
+    if guard is not None:
+        guard.track(closeable)
+
+
+@contextmanager
+def activate(guard: Optional[StreamGuard]) -> Iterator[Optional[StreamGuard]]:
+    token = _current.set(guard)
+    try:
+        yield guard
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            _current.set(None)
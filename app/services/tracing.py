@@ -0,0 +1,292 @@
+"""
+Request-scoped tracing with head- and tail-based sampling.
+
+A Trace is started per chat request and made current through a ContextVar so
+that provider clients can open spans (upstream connect, first chunk) without
+new arguments. Spans are always recorded in memory; the keep/drop decision is
+taken when the trace finishes:
+
+  - head: TRACE_SAMPLE_RATE, or the sampled flag of an incoming `traceparent`
+  - tail: TTFT >= TRACE_TAIL_TTFT_MS, duration >= TRACE_TAIL_DURATION_MS, or any error
+
+Kept traces are exported in the background to a JSONL file (TRACE_EXPORTER=file,
+TRACE_FILE) or an OTLP/HTTP collector (TRACE_EXPORTER=otlp, TRACE_OTLP_ENDPOINT).
+"""
+from __future__ import annotations
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
+
+log = logging.getLogger(__name__)
+
+EXPORTER = (os.getenv("TRACE_EXPORTER") or "none").strip().lower()  # none | file | otlp
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "fauxllama")
+SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TAIL_TTFT_MS = float(os.getenv("TRACE_TAIL_TTFT_MS", "2000"))
+TAIL_DURATION_MS = float(os.getenv("TRACE_TAIL_DURATION_MS", "0"))  # 0 disables the rule
+
+TRACE_HEADER = "X-Trace-Id"
+
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current: ContextVar[Optional["Trace"]] = ContextVar("fauxllama_trace", default=None)
+
+
+def _new_id(nbytes: int) -> str:
+    return "%0*x" % (nbytes * 2, random.getrandbits(nbytes * 8))
+
+
+class Span:
+    def __init__(self, trace: Optional["Trace"], name: str, parent_id: Optional[str],
+                 attributes: Optional[Dict[str, Any]] = None) -> None:
+        self.trace = trace
+        self.name = name
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def record_error(self, error: BaseException) -> None:
+        self.error = f"{type(error).__name__}: {error}"
+        if self.trace is not None:
+            self.trace.error = True
+
+    def end(self) -> None:
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace.trace_id if self.trace else None,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan(Span):
+    def __init__(self) -> None:
+        super().__init__(None, "noop", None)
+
+    def set(self, **attributes: Any) -> None:
+        return
+
+    def record_error(self, error: BaseException) -> None:
+        return
+
+
+class Trace:
+    def __init__(self, name: str, traceparent: Optional[str] = None) -> None:
+        self.trace_id = _new_id(16)
+        remote_parent = None
+        self.head_sampled = random.random() < SAMPLE_RATE
+        match = _TRACEPARENT.match((traceparent or "").strip().lower())
+        if match:
+            self.trace_id, remote_parent, flags = match.groups()
+            self.head_sampled = self.head_sampled or bool(int(flags, 16) & 1)
+        self.error = False
+        self.ttft_ms: Optional[float] = None
+        self.spans: List[Span] = []
+        self._stack: List[Span] = []
+        self.root = self.start_span(name, parent_id=remote_parent)
+        self._stack.append(self.root)
+
+    def start_span(self, name: str, parent_id: Optional[str] = None, **attributes: Any) -> Span:
+        if parent_id is None and self._stack:
+            parent_id = self._stack[-1].span_id
+        s = Span(self, name, parent_id, attributes)
+        self.spans.append(s)
+        return s
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        s = self.start_span(name, **attributes)
+        self._stack.append(s)
+        try:
+            yield s
+        except BaseException as e:
+            if not isinstance(e, GeneratorExit):
+                s.record_error(e)
+            raise
+        finally:
+            s.end()
+            if s in self._stack:
+                self._stack.remove(s)
+
+    def mark_first_byte(self) -> None:
+        if self.ttft_ms is None:
+            self.ttft_ms = (time.time_ns() - self.root.start_ns) / 1e6
+            self.root.set(ttft_ms=round(self.ttft_ms, 3))
+
+    def should_keep(self) -> bool:
+        if self.head_sampled or self.error:
+            return True
+        if self.ttft_ms is not None and self.ttft_ms >= TAIL_TTFT_MS:
+            return True
+        if TAIL_DURATION_MS and self.root.duration_ms >= TAIL_DURATION_MS:
+            return True
+        return False
+
+    def finish(self) -> None:
+        if self.root.end_ns is not None:
+            return
+        for s in self.spans:
+            s.end()
+        if EXPORTER != "none" and self.should_keep():
+            _exporter().submit(self)
+
+
+def start_trace(name: str, traceparent: Optional[str] = None) -> Trace:
+    return Trace(name, traceparent)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def activate(trace: Optional[Trace]) -> Iterator[Optional[Trace]]:
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # Generators may be finalized from a different context.
+            _current.set(None)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """Open a span on the current trace, or a no-op span when there is none."""
+    trace = _current.get()
+    if trace is None:
+        yield _NoopSpan()
+        return
+    with trace.span(name, **attributes) as s:
+        yield s
+
+
+def start_span(name: str, **attributes: Any) -> Span:
+    """Start a span that the caller ends explicitly (e.g. time-to-first-chunk)."""
+    trace = _current.get()
+    if trace is None:
+        return _NoopSpan()
+    return trace.start_span(name, **attributes)
+
+
+class _Exporter:
+    def __init__(self) -> None:
+        self._queue: "queue.Queue[Trace]" = queue.Queue(maxsize=1000)
+        self._session = requests.Session()
+        t = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        t.start()
+
+    def submit(self, trace: Trace) -> None:
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            log.warning("Trace export queue full; dropping trace %s", trace.trace_id)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 50:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if EXPORTER == "file":
+                    self._write_file(batch)
+                elif EXPORTER == "otlp":
+                    self._post_otlp(batch)
+            except Exception:
+                log.exception("Trace export failed")
+
+    def _write_file(self, batch: List[Trace]) -> None:
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            for trace in batch:
+                for s in trace.spans:
+                    f.write(json.dumps(s.to_dict(), ensure_ascii=False) + "\n")
+
+    def _post_otlp(self, batch: List[Trace]) -> None:
+        spans = [_otlp_span(s) for trace in batch for s in trace.spans]
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attr("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": "fauxllama"}, "spans": spans}],
+            }]
+        }
+        resp = self._session.post(OTLP_ENDPOINT, json=body, timeout=(2, 10))
+        if resp.status_code >= 400:
+            log.warning("OTLP collector returned HTTP %s: %s", resp.status_code, resp.text[:200])
+
+
+def _otlp_attr(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        v = {"boolValue": value}
+    elif isinstance(value, int):
+        v = {"intValue": str(value)}
+    elif isinstance(value, float):
+        v = {"doubleValue": value}
+    else:
+        v = {"stringValue": str(value)}
+    return {"key": key, "value": v}
+
+
+def _otlp_span(s: Span) -> Dict[str, Any]:
+    out: Dict[str, Any] = {
+        "traceId": s.trace.trace_id if s.trace else "",
+        "spanId": s.span_id,
+        "name": s.name,
+        "kind": 2 if s.trace is not None and s is s.trace.root else 1,
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(s.end_ns or s.start_ns),
+        "attributes": [_otlp_attr(k, v) for k, v in s.attributes.items()],
+        "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+    }
+    if s.parent_id:
+        out["parentSpanId"] = s.parent_id
+    return out
+
+
+_EXPORTER: Optional[_Exporter] = None
+_EXPORTER_LOCK = threading.Lock()
+
+
+def _exporter() -> _Exporter:
+    global _EXPORTER
+    if _EXPORTER is None:
+        with _EXPORTER_LOCK:
+            if _EXPORTER is None:
+                _EXPORTER = _Exporter()
+    return _EXPORTER
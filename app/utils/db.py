@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+from app.services import metrics
+
+log = logging.getLogger(__name__)
+
+pool_acquire_seconds = metrics.histogram(
+    "fauxllama_db_pool_acquire_seconds",
+    "Time to get a connection from the SQLAlchemy pool: the wait for a free slot, "
+    "plus opening a new connection and the pool_pre_ping round trip when they happen.",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+pool_checkout_timeouts = metrics.counter(
+    "fauxllama_db_pool_checkout_timeouts_total",
+    "Pool checkouts that gave up after DB_POOL_TIMEOUT.",
+)
+pool_checked_out = metrics.gauge(
+    "fauxllama_db_pool_checked_out",
+    "Connections currently checked out of the pool.",
+)
+pool_saturation = metrics.gauge(
+    "fauxllama_db_pool_saturation",
+    "Checked-out connections divided by pool_size + max_overflow.",
+)
+
+_usage_lock = threading.Lock()
+_checked_out = 0
+_capacity = 0
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records acquire time; saturation is tracked by the checkout/checkin events below."""
+
+    def __init__(self, creator, pool_size=5, max_overflow=10, **kw):
+        global _capacity
+        super().__init__(creator, pool_size=pool_size, max_overflow=max_overflow, **kw)
+        _capacity = pool_size + max(max_overflow, 0)
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            pool_checkout_timeouts.inc()
+            raise
+        finally:
+            pool_acquire_seconds.observe(time.perf_counter() - start)
+
+
+def _record_usage(delta):
+    global _checked_out
+    with _usage_lock:
+        _checked_out = max(_checked_out + delta, 0)
+        pool_checked_out.set(_checked_out)
+        pool_saturation.set(_checked_out / _capacity if _capacity else 0.0)
+
+
+@event.listens_for(InstrumentedQueuePool, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    _record_usage(1)
+
+
+@event.listens_for(InstrumentedQueuePool, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    _record_usage(-1)
+
+
+def gevent_wait_callback(conn, timeout=None):
+    """psycopg2 wait callback that yields to the gevent hub instead of blocking."""
+    from psycopg2 import extensions, OperationalError
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise OperationalError(f"Bad result from poll: {state!r}")
+
+
+def _gevent_patched():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("socket")
+
+
+def make_psycopg2_cooperative(mode="auto"):
+    """
+    Install the gevent wait callback on psycopg2.
+
+    mode: "auto" installs it only when gevent has monkey-patched the socket
+    module (i.e. under the gunicorn gevent worker), "true" always, "false" never.
+    Returns True when the callback was installed.
+    """
+    mode = (mode or "auto").strip().lower()
+    if mode in ("0", "false", "no", "off"):
+        return False
+    if mode == "auto" and not _gevent_patched():
+        return False
+    try:
+        from psycopg2 import extensions
+    except ImportError:
+        log.warning("psycopg2 not installed; cannot make DB access cooperative")
+        return False
+    extensions.set_wait_callback(gevent_wait_callback)
+    log.info("Installed gevent wait callback for psycopg2")
+    return True
+
+
+def init_db_pool(app):
+    """Apply pool instrumentation and the gevent wait callback before db.init_app()."""
+    options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    options.setdefault("poolclass", InstrumentedQueuePool)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+    make_psycopg2_cooperative(app.config.get("DB_GEVENT_WAIT_CALLBACK", "auto"))
@@ -0,0 +1,139 @@
+"""
+Single-pass request body decoding.
+
+The body is read once (bounded by MAX_CONTENT_LENGTH, set from
+MAX_REQUEST_BYTES in Config), parsed with orjson when installed, validated,
+and kept on `flask.g.json_body` for the view. Request logging only ever sees a short
+preview of the raw bytes, so multi-megabyte Copilot payloads are not decoded
+or copied again.
+"""
+import json
+import os
+from functools import wraps
+
+from flask import current_app, g, jsonify, request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # pragma: no cover - optional speedup
+    _loads = json.loads
+
+LOG_BODY_CHARS = int(os.environ.get("LOG_BODY_CHARS", "2000"))
+
+MESSAGE_ROLES = {"system", "developer", "user", "assistant", "model", "tool", "function"}
+# What filter_user_model_messages() keeps; the conversation sent upstream
+CHAT_ROLES = {"user", "assistant", "model"}
+_NUMBER_PARAMS = ("temperature", "top_p", "presence_penalty", "frequency_penalty")
+_INT_PARAMS = ("n", "max_tokens", "seed")
+
+
+class BodyError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _max_bytes():
+    return current_app.config.get("MAX_CONTENT_LENGTH")
+
+
+def _over_limit(length):
+    limit = _max_bytes()
+    return limit is not None and length is not None and length > limit
+
+
+def _too_large():
+    return BodyError(f"Request body exceeds {_max_bytes()} bytes", 413)
+
+
+def raw_body():
+    """The request body as bytes, read at most once per request."""
+    if _over_limit(request.content_length):
+        raise _too_large()
+    try:
+        data = request.get_data(cache=True)
+    except RequestEntityTooLarge:
+        raise _too_large()
+    # Chunked bodies have no Content-Length; werkzeug stops reading them at the
+    # limit without raising, so a body that fills the limit was cut short
+    limit = _max_bytes()
+    if request.content_length is None and limit is not None and len(data) >= limit:
+        raise _too_large()
+    return data
+
+
+def body_preview(limit=LOG_BODY_CHARS):
+    """A truncated, printable view of the body for logging."""
+    try:
+        data = raw_body()
+    except BodyError as e:
+        return f"<{e}>"
+    text = data[:limit].decode("utf-8", errors="replace")
+    if len(data) > limit:
+        text += f"... ({len(data)} bytes)"
+    return text
+
+
+def json_body():
+    """The parsed JSON body, cached on `g` so it is only parsed once."""
+    if "json_body" not in g:
+        data = raw_body()
+        try:
+            g.json_body = _loads(data)
+        except ValueError as e:
+            raise BodyError(f"Malformed JSON body: {e}")
+    return g.json_body
+
+
+def validate_object(body):
+    if not isinstance(body, dict):
+        raise BodyError("Request body must be a JSON object")
+
+
+def validate_chat_request(body):
+    validate_object(body)
+    messages = body.get("messages")
+    if not isinstance(messages, list) or not messages:
+        raise BodyError("'messages' must be a non-empty list")
+    for i, m in enumerate(messages):
+        if not isinstance(m, dict):
+            raise BodyError(f"messages[{i}] must be an object")
+        if m.get("role") not in MESSAGE_ROLES:
+            raise BodyError(f"messages[{i}].role must be one of {sorted(MESSAGE_ROLES)}")
+        content = m.get("content")
+        if content is not None and not isinstance(content, (str, list)):
+            raise BodyError(f"messages[{i}].content must be a string or a list of parts")
+    if not any(m["role"] in CHAT_ROLES for m in messages):
+        raise BodyError(f"'messages' must include at least one message with role {sorted(CHAT_ROLES)}")
+    if "model" in body and body["model"] is not None and not isinstance(body["model"], str):
+        raise BodyError("'model' must be a string")
+    for k in _NUMBER_PARAMS:
+        v = body.get(k)
+        if v is not None and (isinstance(v, bool) or not isinstance(v, (int, float))):
+            raise BodyError(f"'{k}' must be a number")
+    for k in _INT_PARAMS:
+        v = body.get(k)
+        if v is not None and (isinstance(v, bool) or not isinstance(v, int)):
+            raise BodyError(f"'{k}' must be an integer")
+    stop = body.get("stop")
+    if stop is not None and not isinstance(stop, (str, list)):
+        raise BodyError("'stop' must be a string or a list of strings")
+    tools = body.get("tools")
+    if tools is not None and not isinstance(tools, list):
+        raise BodyError("'tools' must be a list")
+
+
+def decoded_json(validate=validate_object):
+    """Decode and validate the JSON body before the view runs; 413/400 on failure."""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            try:
+                validate(json_body())
+            except BodyError as e:
+                return jsonify({"error": str(e)}), e.status
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
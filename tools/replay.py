@@ -0,0 +1,250 @@
+"""
+Deterministic replay of captured fauxllama traffic (see app/services/capture.py).
+
+1. Start a fake OpenAI-compatible upstream that reproduces the recorded token
+   timing for each captured request:
+
+       python tools/replay.py upstream --capture captures/traffic.jsonl --port 18080
+
+2. Run fauxllama against it:
+
+       LLM_PROVIDER=openai OPENAI_API_KEY=replay OPENAI_MODEL=replay \\
+       OPENAI_BASE=http://localhost:18080 gunicorn ... run:app
+
+3. Drive fauxllama with the captured requests at original (or scaled) pacing
+   and compare TTFT / throughput with a previous run:
+
+       python tools/replay.py run --capture captures/traffic.jsonl \\
+           --target http://localhost:11434/<API_KEY> --speed 2 \\
+           --out run.json --baseline previous.json
+
+`--speed` scales both request arrival gaps and upstream token timing
+(2 = twice as fast). Only `requests` is needed, so the tool can run outside
+the application environment.
+"""
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+import requests
+
+
+def load_capture(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda r: r["ts"])
+
+
+def match_key(messages: List[Dict[str, Any]]) -> str:
+    # Must agree with app.services.capture.match_key
+    content = messages[-1].get("content") if messages else ""
+    if not isinstance(content, str):
+        content = json.dumps(content, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+# --- fake upstream -----------------------------------------------------------
+
+def make_upstream(records: List[Dict[str, Any]], speed: float) -> type:
+    timings: Dict[str, List[List[float]]] = {}
+    for r in records:
+        chunks = (r.get("upstream") or {}).get("chunks")
+        if chunks:
+            timings.setdefault(r["match_key"], chunks)
+    default = next(iter(timings.values()), [[50.0, 4]] * 20)
+
+    class Upstream(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Small SSE writes would otherwise sit behind Nagle + delayed ACK (~40ms)
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args: Any) -> None:
+            return
+
+        def _json(self, body: Dict[str, Any]) -> None:
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:
+            self._json({"object": "list", "data": [{"id": "replay", "object": "model"}]})
+
+        def do_POST(self) -> None:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path.endswith("/embeddings"):
+                inputs = body.get("input") or []
+                inputs = [inputs] if isinstance(inputs, str) else inputs
+                self._json({"data": [{"index": i, "embedding": [0.0] * 8} for i in range(len(inputs))]})
+                return
+
+            chunks = timings.get(match_key(body.get("messages") or []), default)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            start = time.perf_counter()
+            try:
+                for offset_ms, size in chunks:
+                    delay = offset_ms / 1000.0 / speed - (time.perf_counter() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+                    ev = {"id": "replay", "model": body.get("model"),
+                          "choices": [{"index": 0, "delta": {"content": "x" * int(size)}}]}
+                    self._chunk(f"data: {json.dumps(ev)}\n\n")
+                self._chunk("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def _chunk(self, text: str) -> None:
+            data = text.encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+    return Upstream
+
+
+def cmd_upstream(args: argparse.Namespace) -> None:
+    records = load_capture(args.capture)
+    server = ThreadingHTTPServer((args.host, args.port), make_upstream(records, args.speed))
+    print(f"Fake upstream with {len(records)} recorded streams on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+# --- load driver -------------------------------------------------------------
+
+def replay_one(target: str, record: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+    payload = {"model": record.get("model"), "messages": record["messages"], "stream": True,
+               **(record.get("params") or {})}
+    result: Dict[str, Any] = {"match_key": record["match_key"], "ttft_ms": None, "total_ms": None,
+                              "chars": 0, "chunks": 0, "error": None}
+    start = time.perf_counter()
+    try:
+        with requests.post(f"{target}/v1/chat/completions", json=payload, stream=True,
+                           timeout=(5, timeout)) as resp:
+            resp.raise_for_status()
+            for raw in resp.iter_lines():
+                if not raw.startswith(b"data: "):
+                    continue
+                ev = json.loads(raw[6:])
+                if "error" in ev:
+                    result["error"] = ev["error"]
+                    continue
+                text = "".join((c.get("delta") or {}).get("content") or "" for c in ev.get("choices") or [])
+                if text and result["ttft_ms"] is None:
+                    result["ttft_ms"] = (time.perf_counter() - start) * 1000
+                result["chars"] += len(text)
+                result["chunks"] += 1
+    except Exception as e:
+        result["error"] = str(e)
+    result["total_ms"] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def _pct(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 1)
+
+
+def summarize(results: List[Dict[str, Any]], wall_s: float) -> Dict[str, Any]:
+    ok = [r for r in results if not r["error"] and r["ttft_ms"] is not None]
+    ttft = [r["ttft_ms"] for r in ok]
+    rates = [r["chars"] / ((r["total_ms"] - r["ttft_ms"]) / 1000)
+             for r in ok if r["total_ms"] - r["ttft_ms"] > 0]
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "wall_s": round(wall_s, 2),
+        "ttft_ms": {"p50": _pct(ttft, 0.5), "p90": _pct(ttft, 0.9), "p99": _pct(ttft, 0.99),
+                    "mean": round(statistics.mean(ttft), 1) if ttft else None},
+        "throughput_chars_per_s": {"p50": _pct(rates, 0.5),
+                                   "mean": round(statistics.mean(rates), 1) if rates else None},
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    lines = []
+    for section, keys in (("ttft_ms", ("p50", "p90", "p99", "mean")),
+                          ("throughput_chars_per_s", ("p50", "mean"))):
+        for k in keys:
+            new, old = current[section].get(k), baseline.get(section, {}).get(k)
+            if new is None or not old:
+                continue
+            lines.append(f"{section}.{k}: {old} -> {new} ({(new - old) / old * 100:+.1f}%)")
+    lines.append(f"errors: {baseline.get('errors')} -> {current['errors']}")
+    return lines
+
+
+def cmd_run(args: argparse.Namespace) -> None:
+    records = load_capture(args.capture)
+    if args.limit:
+        records = records[:args.limit]
+    results: List[Optional[Dict[str, Any]]] = [None] * len(records)
+    threads = []
+    t0 = time.perf_counter()
+    base_ts = records[0]["ts"] if records else 0.0
+    for i, record in enumerate(records):
+        delay = (record["ts"] - base_ts) / args.speed - (time.perf_counter() - t0)
+        if delay > 0:
+            time.sleep(delay)
+
+        def work(i: int = i, record: Dict[str, Any] = record) -> None:
+            results[i] = replay_one(args.target.rstrip("/"), record, args.timeout)
+
+        t = threading.Thread(target=work, daemon=True)
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+
+    summary = summarize([r for r in results if r is not None], time.perf_counter() - t0)
+    summary["capture"] = args.capture
+    summary["speed"] = args.speed
+    print(json.dumps(summary, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({**summary, "results": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            print("\n".join(compare(summary, json.load(f))))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    up = sub.add_parser("upstream", help="serve recorded token timing as a fake OpenAI upstream")
+    up.add_argument("--capture", required=True)
+    up.add_argument("--host", default="127.0.0.1")
+    up.add_argument("--port", type=int, default=18080)
+    up.add_argument("--speed", type=float, default=1.0)
+    up.set_defaults(func=cmd_upstream)
+
+    run = sub.add_parser("run", help="replay captured requests against a running fauxllama")
+    run.add_argument("--capture", required=True)
+    run.add_argument("--target", required=True, help="http://host:11434/<API_KEY>")
+    run.add_argument("--speed", type=float, default=1.0)
+    run.add_argument("--limit", type=int, default=0)
+    run.add_argument("--timeout", type=float, default=300)
+    run.add_argument("--out")
+    run.add_argument("--baseline", help="report JSON from a previous run to compare against")
+    run.set_defaults(func=cmd_run)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())